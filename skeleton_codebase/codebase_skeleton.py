@@ -5,12 +5,34 @@ Generates LLM-optimized structural representations of codebases.
 """
 
 import argparse
+import fnmatch
+import hashlib
+import io
+import itertools
+import mmap
+import os
+import re
+import shutil
+import sqlite3
 import sys
+import tempfile
+import threading
 from pathlib import Path
 from dataclasses import dataclass, field
-from typing import List, Set, Dict, Optional
-from collections import defaultdict
-import re
+from typing import (
+    ClassVar,
+    FrozenSet,
+    Iterator,
+    List,
+    Set,
+    Dict,
+    Optional,
+    Tuple,
+    TextIO,
+)
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
 
 try:
     import tree_sitter_python as tspython
@@ -48,7 +70,11 @@ except ImportError:
 
 @dataclass
 class Config:
-    """Configuration for skeleton extraction."""
+    """Configuration for skeleton extraction.
+
+    Pattern sets must be passed at construction: the derived matchers are
+    built once in __post_init__.
+    """
 
     mode: str = "skeleton"  # skeleton, overview, hybrid, custom
     include_full: Set[str] = field(default_factory=set)
@@ -56,109 +82,437 @@ class Config:
     skeleton_only: Set[str] = field(default_factory=set)
     exclude: Set[str] = field(default_factory=set)
     max_tokens: int = 50000
+    max_file_size: int = 10 * 1024 * 1024  # Larger files are skipped unread
     show_deps: bool = False
     show_excluded: bool = False  # NEW LINE: Show detailed excluded directories list
+    sorted_tree: bool = True  # False lists the tree in filesystem order
+    processes: bool = False  # Extract in worker processes instead of threads
+    token_cache: bool = False  # Persist token counts in TOKEN_CACHE_PATH
+    exact_tokens: bool = False  # Encode tiny texts too instead of estimating
+    dedupe_skeletons: bool = False  # Emit identical skeletons once, with all paths
     output: Optional[str] = None
 
+    # Derived in __post_init__ for tree pruning
+    _excluded_names: FrozenSet[str] = field(init=False, repr=False)
+    _excluded_globs: FrozenSet[str] = field(init=False, repr=False)
+    _tree_path_re: Optional[re.Pattern] = field(init=False, repr=False)
+
+    # Derived in __post_init__ for SkeletonGenerator.should_exclude
+    _exclude_literals: FrozenSet[str] = field(init=False, repr=False)
+    _exclude_suffixes: tuple = field(init=False, repr=False)
+    _exclude_part_re: Optional[re.Pattern] = field(init=False, repr=False)
+    _exclude_path_re: Optional[re.Pattern] = field(init=False, repr=False)
+
+    # Derived in __post_init__ for SkeletonGenerator.should_full_content
+    _include_re: Optional[re.Pattern] = field(init=False, repr=False)
+
     # Smart defaults
-    DEFAULT_FULL_PATTERNS = {
-        "README.md",
-        "package.json",
-        "requirements.txt",  # ← Added
-        "setup.py",
-        "setup.cfg",
-        "pyproject.toml",  # ← Added
-        "tsconfig.json",
-        "docker-compose.yml",
-        "Dockerfile",
-        ".gitignore",
-        ".dockerignore",
-        "config.yaml",
-    }
-
-    DEFAULT_EXCLUDE_PATTERNS = {
-        "node_modules",
-        "venv",
-        "env",
-        ".env",
-        ".venv",
-        ".git",
-        ".svn",
-        ".hg",
-        "__pycache__",
-        ".pytest_cache",
-        ".mypy_cache",
-        "build",
-        "dist",
-        "target",
-        ".next",
-        ".nuxt",
-        "coverage",
-        ".coverage",
-        "htmlcov",
-        ".DS_Store",
-        "Thumbs.db",
-        "*.pyc",
-        "*.pyo",
-        "*.pyd",
-        ".Python",
-        "*.so",
-        "*.dylib",
-        "*.dll",
-        "*.egg",
-        "*.egg-info",
-        ".idea",
-        ".vscode",
-        "*.swp",
-        "*.swo",
-        ".pkl",
-        ".parquet",
-        # NOTE: .gitignore and .dockerignore are deliberately NOT in this list
-        # They are config files in DEFAULT_FULL_PATTERNS and should be included
-    }
-
-    EXCLUDE_DIRS = {
-        # "tests",
-        # "test",
-        "__tests__",
-        "migrations",
-        "db/migrate",
-        "docs",
-        "documentation",
-        "examples",
-        "samples",
-        "static",
-        "public",
-        "assets",
-        "media",
-        "vendor",
-        "third_party",
-    }
+    DEFAULT_FULL_PATTERNS: ClassVar[FrozenSet[str]] = frozenset(
+        {
+            "README.md",
+            "package.json",
+            "requirements.txt",  # ← Added
+            "setup.py",
+            "setup.cfg",
+            "pyproject.toml",  # ← Added
+            "tsconfig.json",
+            "docker-compose.yml",
+            "Dockerfile",
+            ".gitignore",
+            ".dockerignore",
+            "config.yaml",
+        }
+    )
+
+    DEFAULT_EXCLUDE_PATTERNS: ClassVar[FrozenSet[str]] = frozenset(
+        {
+            "node_modules",
+            "venv",
+            "env",
+            ".env",
+            ".venv",
+            ".git",
+            ".svn",
+            ".hg",
+            "__pycache__",
+            ".pytest_cache",
+            ".mypy_cache",
+            "build",
+            "dist",
+            "target",
+            ".next",
+            ".nuxt",
+            "coverage",
+            ".coverage",
+            "htmlcov",
+            ".DS_Store",
+            "Thumbs.db",
+            "*.pyc",
+            "*.pyo",
+            "*.pyd",
+            ".Python",
+            "*.so",
+            "*.dylib",
+            "*.dll",
+            "*.egg",
+            "*.egg-info",
+            ".idea",
+            ".vscode",
+            "*.swp",
+            "*.swo",
+            ".pkl",
+            ".parquet",
+            # NOTE: .gitignore and .dockerignore are deliberately NOT in this list
+            # They are config files in DEFAULT_FULL_PATTERNS and should be included
+        }
+    )
+
+    EXCLUDE_DIRS: ClassVar[FrozenSet[str]] = frozenset(
+        {
+            # "tests",
+            # "test",
+            "__tests__",
+            "migrations",
+            "db/migrate",
+            "docs",
+            "documentation",
+            "examples",
+            "samples",
+            "static",
+            "public",
+            "assets",
+            "media",
+            "vendor",
+            "third_party",
+        }
+    )
+
+    # Binary formats are never read: a skeleton of them is meaningless
+    BINARY_EXTENSIONS: ClassVar[FrozenSet[str]] = frozenset(
+        {
+            ".zip",
+            ".pkl",
+            ".bin",
+            ".h5",
+            ".parquet",
+            ".exe",
+            ".dll",
+            ".so",
+            ".pyc",
+            ".pt",
+            ".png",
+            ".jpg",
+            ".jpeg",
+            ".gif",
+            ".pdf",
+        }
+    )
+
+    # Config files that are always shown, even if a pattern would hide them
+    NEVER_IGNORE: ClassVar[FrozenSet[str]] = frozenset({".gitignore", ".dockerignore"})
+
+    def __post_init__(self):
+        patterns = self.DEFAULT_EXCLUDE_PATTERNS | self.exclude | self.EXCLUDE_DIRS
+        globs = frozenset(p for p in patterns if "*" in p)
+        self._excluded_names = frozenset(patterns - globs)
+        # A glob spanning directories can never match a bare name, so the
+        # tree matches it against the relative path like _matches_exclude
+        path_globs = sorted(p.rstrip("/") for p in globs if "/" in p.rstrip("/"))
+        self._excluded_globs = frozenset(p for p in globs if "/" not in p.rstrip("/"))
+        self._tree_path_re = _compile_alternation(
+            src
+            for pattern in path_globs
+            for src in (re.escape(pattern), _path_glob_to_regex(pattern))
+        )
+
+        # Default patterns apply to any path component: literals by set
+        # membership, "*.ext" globs by a single endswith over a tuple, and
+        # anything else through one per-component regex
+        default_globs = {p for p in self.DEFAULT_EXCLUDE_PATTERNS if "*" in p}
+        suffix_globs = {
+            p for p in default_globs if p.startswith("*.") and not _has_glob(p[1:])
+        }
+        self._exclude_literals = frozenset(
+            (self.DEFAULT_EXCLUDE_PATTERNS - default_globs) | self.EXCLUDE_DIRS
+        )
+        self._exclude_suffixes = tuple(sorted(p[1:] for p in suffix_globs))
+        self._exclude_part_re = _compile_alternation(
+            fnmatch.translate(p) for p in sorted(default_globs - suffix_globs)
+        )
+
+        # Custom patterns match as a substring of the relative path or as a
+        # right-anchored glob, like PurePath.match
+        sources = []
+        for pattern in sorted(self.exclude):
+            pattern_clean = pattern.rstrip("/")
+            if not pattern_clean:
+                continue
+            sources.append(re.escape(pattern_clean))
+            if _has_glob(pattern_clean):
+                sources.append(_path_glob_to_regex(pattern_clean))
+        self._exclude_path_re = _compile_alternation(sources)
+
+        # Include patterns are right-anchored globs (PurePath.match), matched
+        # against the absolute posix path without its leading slash
+        self._include_re = _compile_alternation(
+            _path_glob_to_regex(p)
+            for p in sorted(self.include_patterns)
+            if p.strip("/")
+        )
+
+    def is_excluded_name(self, name: str, rel_path: Optional[str] = None) -> bool:
+        """Check a file or directory name against the exclusion sets.
+
+        ``rel_path`` is the entry's posix path relative to the root; globs
+        containing a slash are only matched when it is given.
+        """
+        if name in self.NEVER_IGNORE:
+            return False
+        if name in self._excluded_names:
+            return True
+        if any(fnmatch.fnmatch(name, glob) for glob in self._excluded_globs):
+            return True
+        return (
+            rel_path is not None
+            and self._tree_path_re is not None
+            and self._tree_path_re.search(rel_path) is not None
+        )
+
+
+def _has_glob(pattern: str) -> bool:
+    """Check whether a pattern contains glob metacharacters."""
+    return any(ch in pattern for ch in "*?[")
+
+
+def _compile_alternation(sources) -> Optional[re.Pattern]:
+    """Join regex sources into one compiled alternation, or None if empty."""
+    sources = list(sources)
+    if not sources:
+        return None
+    return re.compile("|".join(f"(?:{src})" for src in sources))
+
+
+def _path_glob_to_regex(pattern: str) -> str:
+    """Translate a glob into a regex matching a relative posix path from the right.
+
+    Mirrors PurePath.match: wildcards never cross a '/' and a relative
+    pattern only has to match the trailing path components.
+    """
+    anchored = pattern.startswith("/")
+    pattern = pattern.strip("/")
+    out = []
+    i, n = 0, len(pattern)
+    while i < n:
+        ch = pattern[i]
+        i += 1
+        if ch == "*":
+            out.append("[^/]*")
+        elif ch == "?":
+            out.append("[^/]")
+        elif ch == "[":
+            end = pattern.find("]", i + 1 if pattern[i : i + 1] == "!" else i)
+            if end == -1:
+                out.append("\\[")
+            else:
+                body = pattern[i:end].replace("\\", "\\\\")
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                out.append(f"[{body}]")
+                i = end + 1
+        else:
+            out.append(re.escape(ch))
+    return ("^" if anchored else "(?:^|/)") + "".join(out) + "$"
+
+
+@lru_cache(maxsize=4)
+def _get_encoding(name: str):
+    """Load a tiktoken encoding once per process."""
+    # tiktoken caches the BPE file under the system temp dir by default,
+    # which is often cleared; keep it somewhere persistent unless told otherwise
+    if (
+        "TIKTOKEN_CACHE_DIR" not in os.environ
+        and "DATA_GYM_CACHE_DIR" not in os.environ
+    ):
+        os.environ["TIKTOKEN_CACHE_DIR"] = str(Path.home() / ".cache" / "tiktoken")
+    return tiktoken.get_encoding(name)
+
+
+# Persistent token counts shared across runs (see TokenCounter)
+TOKEN_CACHE_PATH = Path.home() / ".cache" / "codebase_skeleton" / "tokens.sqlite"
 
 
 class TokenCounter:
-    """Token counting utility."""
+    """Token counting utility.
 
-    def __init__(self):
+    Counts for longer texts are cached by content hash. With a cache_path
+    they are also persisted in SQLite, so unchanged files are not
+    re-tokenized on the next run; call flush() to write new counts.
+    Unless exact is set, texts shorter than SHORT_TEXT_LENGTH are estimated
+    by their UTF-8 byte length, an upper bound, instead of encoded.
+    """
+
+    # Shorter texts are re-encoded; hashing them costs about as much
+    MIN_CACHED_LENGTH = 256
+    # Below this many chars, encoder call overhead outweighs the count
+    SHORT_TEXT_LENGTH = 64
+
+    def __init__(self, cache_path: Optional[Path] = None, exact: bool = True):
         if TIKTOKEN_AVAILABLE:
-            self.encoder = tiktoken.get_encoding("cl100k_base")
+            self.encoder = _get_encoding("cl100k_base")
         else:
             self.encoder = None
+        self.exact = exact
+        self._cache: Dict[bytes, int] = {}
+        self._db = None
+        self._unsaved: List[Tuple[bytes, int]] = []
+        if cache_path is not None and self.encoder:
+            self._open_db(Path(cache_path))
+
+    def _open_db(self, cache_path: Path) -> None:
+        """Open (creating if needed) the persistent token-count cache."""
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(cache_path))
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS tokens "
+                "(hash BLOB, enc TEXT, n INTEGER, PRIMARY KEY (hash, enc))"
+            )
+        except (OSError, sqlite3.Error) as e:
+            print(f"Warning: Token cache unavailable: {e}", file=sys.stderr)
+            self._db = None
+
+    def _lookup(self, key: bytes) -> Optional[int]:
+        """Return a cached count from memory or the persistent cache."""
+        tokens = self._cache.get(key)
+        if tokens is None and self._db is not None:
+            row = self._db.execute(
+                "SELECT n FROM tokens WHERE hash = ? AND enc = ?",
+                (key, self.encoder.name),
+            ).fetchone()
+            if row is not None:
+                tokens = self._cache[key] = row[0]
+        return tokens
+
+    def _store(self, key: bytes, tokens: int) -> None:
+        """Remember a computed count, queueing it for the persistent cache."""
+        self._cache[key] = tokens
+        if self._db is not None:
+            self._unsaved.append((key, tokens))
+
+    def flush(self) -> None:
+        """Write counts computed since the last flush to the persistent cache."""
+        if self._db is None or not self._unsaved:
+            return
+        try:
+            with self._db:
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO tokens (hash, enc, n) VALUES (?, ?, ?)",
+                    [(key, self.encoder.name, n) for key, n in self._unsaved],
+                )
+        except sqlite3.Error as e:
+            print(f"Warning: Could not update token cache: {e}", file=sys.stderr)
+        self._unsaved.clear()
+
+    def close(self) -> None:
+        """Flush pending counts and close the persistent cache.
+
+        Later counts are still cached in memory, just not persisted.
+        """
+        if self._db is None:
+            return
+        self.flush()
+        self._db.close()
+        self._db = None
 
     def count(self, text: str) -> int:
-        """Count tokens in text."""
-        if self.encoder:
-            return len(self.encoder.encode(text))
-        # Rough approximation: 4 chars per token
-        return len(text) // 4
+        """Count tokens in text, reusing counts for identical content."""
+        if not self.encoder:
+            # Rough approximation: 4 chars per token
+            return len(text) // 4
+
+        tokens = self._short_count(text)
+        if tokens is not None:
+            return tokens
+
+        if len(text) < self.MIN_CACHED_LENGTH:
+            return len(self.encoder.encode_ordinary(text))
+
+        key = self._cache_key(text)
+        tokens = self._lookup(key)
+        if tokens is None:
+            tokens = len(self.encoder.encode_ordinary(text))
+            self._store(key, tokens)
+        return tokens
+
+    def count_batch(self, texts: List[str]) -> List[int]:
+        """Count tokens for several texts with a single batched encoder call."""
+        if not self.encoder:
+            return [len(text) // 4 for text in texts]
+
+        counts = [0] * len(texts)
+        misses = []  # (index, cache key or None for uncached short texts)
+        for i, text in enumerate(texts):
+            tokens = self._short_count(text)
+            if tokens is not None:
+                counts[i] = tokens
+                continue
+            key = None
+            if len(text) >= self.MIN_CACHED_LENGTH:
+                key = self._cache_key(text)
+                tokens = self._lookup(key)
+                if tokens is not None:
+                    counts[i] = tokens
+                    continue
+            misses.append((i, key))
+
+        if misses:
+            encoded = self.encoder.encode_ordinary_batch(
+                [texts[i] for i, _ in misses], num_threads=os.cpu_count() or 1
+            )
+            for (i, key), tokens in zip(misses, encoded):
+                counts[i] = len(tokens)
+                if key is not None:
+                    self._store(key, counts[i])
+        return counts
+
+    def _short_count(self, text: str) -> Optional[int]:
+        """Count empty and (unless exact) tiny texts without the encoder."""
+        n = len(text)
+        if n == 0:
+            return 0
+        if n < self.SHORT_TEXT_LENGTH and not self.exact:
+            # Every token covers at least one UTF-8 byte, so the byte length
+            # overcounts rather than undercounts
+            if text.isascii():
+                return n
+            return len(text.encode("utf-8", "surrogatepass"))
+        return None
+
+    @staticmethod
+    def _cache_key(text: str) -> bytes:
+        """Content hash used as the token-count cache key."""
+        return hashlib.blake2b(
+            text.encode("utf-8", "surrogatepass"), digest_size=16
+        ).digest()
 
 
 class TreeBuilder:
     """Directory tree builder using directory_tree or fallback."""
 
+    # Directories at this depth or deeper are not listed
+    MAX_DEPTH = 5
+
     @staticmethod
-    def build(root: Path, config: Config) -> str:
-        """Build directory tree representation."""
+    def build(
+        root: Path,
+        config: Config,
+        listings: Optional[Dict[str, List[Tuple[bool, str, str]]]] = None,
+    ) -> str:
+        """Build directory tree representation.
+
+        listings maps directory paths to (is_file, name, path) entries already
+        scanned by the caller; the fallback tree only scans the others.
+        """
         if DIRECTORY_TREE_AVAILABLE:
             try:
                 # Build ignore list from config
@@ -174,98 +528,200 @@ class TreeBuilder:
                     f"Warning: directory_tree failed: {e}, using fallback",
                     file=sys.stderr,
                 )
-                return TreeBuilder._fallback_tree(root, config)
+                return TreeBuilder._fallback_tree(root, config, listings)
         else:
-            return TreeBuilder._fallback_tree(root, config)
+            return TreeBuilder._fallback_tree(root, config, listings)
 
     @staticmethod
-    def _fallback_tree(root: Path, config: Config) -> str:
-        """Fallback ASCII tree builder."""
-        lines = [f"{root.name}/"]
-
-        def should_ignore(path: Path) -> bool:
-            """Check if path should be ignored in tree."""
-            # Special case: Never ignore .gitignore or .dockerignore
-            # These are config files we want to show
-            if path.name in {".gitignore", ".dockerignore"}:
-                return False
-
-            # Check custom exclusions first (use name-based matching for simplicity)
-            for pattern in config.exclude:
-                # For patterns starting with '.', do exact name match
-                if pattern.startswith("."):
-                    if path.name == pattern:
-                        return True
-                # For wildcard patterns like "*.pyc"
-                elif "*" in pattern:
-                    if path.match(pattern):
-                        return True
-                # For other patterns, check if they match the name or any parent directory name
-                else:
-                    # Check if the pattern matches this path's name
-                    if path.name == pattern:
-                        return True
-                    # Check if pattern appears in any parent directory name
-                    try:
-                        rel_path = path.relative_to(root)
-                        if pattern in rel_path.parts:
-                            return True
-                    except ValueError:
-                        # If we can't get relative path, check absolute path parts
-                        if pattern in path.parts:
-                            return True
-
-            # Check default exclusions
-            for pattern in config.DEFAULT_EXCLUDE_PATTERNS:
-                # For patterns starting with '.', do exact name match
-                if pattern.startswith("."):
-                    if path.name == pattern:
-                        return True
-                # For wildcard patterns like "*.pyc"
-                elif "*" in pattern:
-                    if path.match(pattern):
-                        return True
-                # For other patterns, check if they match as directory/file names
-                else:
-                    # Check if pattern matches the name
-                    if path.name == pattern:
-                        return True
-                    # Check if pattern appears in path hierarchy
-                    try:
-                        rel_path = path.relative_to(root)
-                        if pattern in rel_path.parts:
-                            return True
-                    except ValueError:
-                        if pattern in path.parts:
-                            return True
-            return False
-
-        def add_dir(path: Path, prefix: str = "", depth: int = 0):
+    def _fallback_tree(
+        root: Path,
+        config: Config,
+        listings: Optional[Dict[str, List[Tuple[bool, str, str]]]] = None,
+    ) -> str:
+        """Fallback ASCII tree builder.
+
+        Excluded directories are dropped by name before recursing, so large
+        trees like node_modules are never listed.
+        """
+        out = io.StringIO()
+        out.write(root.name)
+        out.write("/")
+        write = out.write
+        if listings is None:
+            listings = {}
+
+        root_str = str(root)
+        match_paths = config._tree_path_re is not None
+
+        def is_excluded(name: str, entry_path: str) -> bool:
+            # Relative paths are only built when a slash glob needs them
+            if not match_paths:
+                return config.is_excluded_name(name)
+            rel_path = entry_path[len(root_str) + 1 :].replace(os.sep, "/")
+            return config.is_excluded_name(name, rel_path)
+
+        def add_dir(path: str, prefix: str = "", depth: int = 0):
             # Limit depth to 5 levels (0-4)
-            if depth >= 5:
-                return
-
-            try:
-                items = sorted(path.iterdir(), key=lambda x: (not x.is_dir(), x.name))
-            except PermissionError:
+            if depth >= TreeBuilder.MAX_DEPTH:
                 return
 
-            # Filter items before processing
-            items = [item for item in items if not should_ignore(item)]
-
-            for i, item in enumerate(items):
-                is_last = i == len(items) - 1
+            listing = listings.get(path)
+            if listing is not None:
+                entries = [
+                    entry for entry in listing if not is_excluded(entry[1], entry[2])
+                ]
+            else:
+                # is_dir() comes from the cached readdir type, so each entry
+                # is checked once without a stat
+                try:
+                    with os.scandir(path) as it:
+                        entries = [
+                            (not entry.is_dir(), entry.name, entry.path)
+                            for entry in it
+                            if not is_excluded(entry.name, entry.path)
+                        ]
+                except PermissionError:
+                    return
+
+            if config.sorted_tree:
+                # Directories first, then by name
+                entries.sort()
+
+            last = len(entries) - 1
+            for i, (is_file, name, entry_path) in enumerate(entries):
+                is_last = i == last
                 current = "└── " if is_last else "├── "
                 extension = "    " if is_last else "│   "
 
-                if item.is_dir():
-                    lines.append(f"{prefix}{current}{item.name}/")
-                    add_dir(item, prefix + extension, depth + 1)
-                else:
-                    lines.append(f"{prefix}{current}{item.name}")
+                write("\n")
+                write(prefix)
+                write(current)
+                write(name)
+                if not is_file:
+                    write("/")
+                    add_dir(entry_path, prefix + extension, depth + 1)
+
+        add_dir(root_str)
+        return out.getvalue()
+
+
+def _line_span(source_bytes: bytes, start_byte: int, end_byte: int = -1) -> bytes:
+    """Slice the whole source lines covering start_byte..end_byte, without the
+    trailing newline. end_byte defaults to start_byte (a single line)."""
+    line_start = source_bytes.rfind(b"\n", 0, start_byte) + 1
+    line_end = source_bytes.find(b"\n", max(start_byte, end_byte))
+    if line_end == -1:
+        line_end = len(source_bytes)
+    return source_bytes[line_start:line_end]
+
+
+_PARSER_TYPES = ("python", "javascript", "jsx", "typescript", "tsx")
+
+# Map extensions to parser types
+_EXT_PARSER_TYPES = {
+    "py": "python",
+    "js": "javascript",
+    "jsx": "jsx",
+    "ts": "typescript",
+    "tsx": "tsx",
+}
+
+# Sources at least this large are memory-mapped rather than read()
+MMAP_THRESHOLD = 64 * 1024
+
+
+def _is_utf8(data: bytes) -> bool:
+    """Check that data decodes as UTF-8 (ASCII is checked without decoding)."""
+    if data.isascii():
+        return True
+    try:
+        data.decode("utf-8")
+    except UnicodeDecodeError:
+        return False
+    return True
+
 
-        add_dir(root)
-        return "\n".join(lines)
+def _read_source(path: Path) -> bytes:
+    """Read a file's raw bytes, memory-mapping large files.
+
+    Unbuffered: FileIO sizes its buffer from fstat and reads the whole file
+    in one call, without a BufferedReader copy in between.
+    """
+    with open(path, "rb", buffering=0) as f:
+        if os.fstat(f.fileno()).st_size < MMAP_THRESHOLD:
+            return f.read()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return mm[:]
+
+
+# Python queries for extraction
+_PYTHON_QUERY = """
+(import_statement) @import
+(import_from_statement) @import
+(function_definition) @function
+(class_definition) @class
+"""
+
+# Simplified query for all JS-family languages
+_JS_QUERY = """
+(import_statement) @import
+(export_statement) @export
+(function_declaration) @function
+(arrow_function) @function
+(method_definition) @function
+(class_declaration) @class
+"""
+
+
+@lru_cache(maxsize=None)
+def _get_language(parser_type: str):
+    """Load the Tree-sitter language for a parser type once per process."""
+    if parser_type == "python":
+        return Language(tspython.language())
+    if parser_type in ("javascript", "jsx"):
+        return Language(tsjavascript.language())
+    if parser_type == "typescript":
+        return Language(tstypescript.language_typescript())
+    if parser_type == "tsx":
+        return Language(tstypescript.language_tsx())
+    raise ValueError(f"Unknown parser type: {parser_type}")
+
+
+@lru_cache(maxsize=None)
+def _get_query(parser_type: str):
+    """Compile the extraction query for a parser type once per process."""
+    query_text = _PYTHON_QUERY if parser_type == "python" else _JS_QUERY
+    return Query(_get_language(parser_type), query_text)
+
+
+# Line prefixes the fallback extractor keeps verbatim or as signatures
+_FALLBACK_IMPORT_KEYWORDS = (
+    "import ",
+    "from ",
+    "const ",
+    "let ",
+    "var ",
+    "export ",
+    "require(",
+)
+_FALLBACK_DEF_KEYWORDS = (
+    "def ",
+    "function ",
+    "async def",
+    "async function",
+    "export function",
+    "export class",
+    "export const",
+)
+# Any line the fallback extractor could capture starts with one of these
+_FALLBACK_ANCHOR_RE = re.compile(
+    r"^\s*(?:class |"
+    + "|".join(
+        re.escape(kw) for kw in _FALLBACK_IMPORT_KEYWORDS + _FALLBACK_DEF_KEYWORDS
+    )
+    + ")",
+    re.MULTILINE,
+)
 
 
 class CodeExtractor:
@@ -274,92 +730,105 @@ class CodeExtractor:
     def __init__(self):
         self.parsers = {}
         self.queries = {}
+        # Extension (no dot, lowercase) -> parser type, for loaded parsers only
+        self.parser_types: Dict[str, str] = {}
+        # Parsers and query cursors are not safe to share between threads;
+        # each worker lazily builds its own and reuses them across files
+        self._local = threading.local()
         if TREE_SITTER_AVAILABLE:
             self._init_parsers()
 
+    def _get_parser(self, parser_type: str):
+        """Return a parser for parser_type owned by the calling thread."""
+        parsers = getattr(self._local, "parsers", None)
+        if parsers is None:
+            parsers = self._local.parsers = {}
+        parser = parsers.get(parser_type)
+        if parser is None:
+            parser = Parser(_get_language(parser_type))
+            parsers[parser_type] = parser
+        return parser
+
+    def _get_cursor(self, parser_type: str):
+        """Return a query cursor for parser_type owned by the calling thread."""
+        cursors = getattr(self._local, "cursors", None)
+        if cursors is None:
+            cursors = self._local.cursors = {}
+        cursor = cursors.get(parser_type)
+        if cursor is None:
+            cursor = QueryCursor(self.queries[parser_type])
+            cursors[parser_type] = cursor
+        return cursor
+
     def _init_parsers(self):
         """Initialize Tree-sitter parsers with v0.21+ API."""
         try:
-            # Python
-            PY_LANGUAGE = Language(tspython.language())
-            self.parsers["python"] = Parser(PY_LANGUAGE)
-
-            # Python queries for extraction
-            self.queries["python"] = Query(
-                PY_LANGUAGE,
-                """
-                (import_statement) @import
-                (import_from_statement) @import
-                (function_definition) @function
-                (class_definition) @class
-                """,
-            )
-
-            # JavaScript/TypeScript
-            JS_LANGUAGE = Language(tsjavascript.language())
-            self.parsers["javascript"] = Parser(JS_LANGUAGE)
-            self.parsers["jsx"] = Parser(JS_LANGUAGE)
-
-            # TypeScript
-            TS_LANGUAGE = Language(tstypescript.language_typescript())
-            self.parsers["typescript"] = Parser(TS_LANGUAGE)
-
-            # TypeScript JSX
-            TSX_LANGUAGE = Language(tstypescript.language_tsx())
-            self.parsers["tsx"] = Parser(TSX_LANGUAGE)
-
-            # Simplified query for all JS-family languages
-            js_query_text = """
-            (import_statement) @import
-            (export_statement) @export
-            (function_declaration) @function
-            (arrow_function) @function
-            (method_definition) @function
-            (class_declaration) @class
-            """
-
-            self.queries["javascript"] = Query(JS_LANGUAGE, js_query_text)
-            self.queries["jsx"] = Query(JS_LANGUAGE, js_query_text)
-            self.queries["typescript"] = Query(TS_LANGUAGE, js_query_text)
-            self.queries["tsx"] = Query(TSX_LANGUAGE, js_query_text)
+            for parser_type in _PARSER_TYPES:
+                self.parsers[parser_type] = Parser(_get_language(parser_type))
+                self.queries[parser_type] = _get_query(parser_type)
+            self.parser_types = dict(_EXT_PARSER_TYPES)
 
         except Exception as e:
             print(f"Warning: Tree-sitter init failed: {e}", file=sys.stderr)
             self.parsers = {}
             self.queries = {}
+            self.parser_types = {}
+
+    def has_parser(self, file_path: Path) -> bool:
+        """Whether file_path is handled by a Tree-sitter parser."""
+        return file_path.suffix.lstrip(".").lower() in self.parser_types
 
     def extract_skeleton(self, file_path: Path, content: str) -> str:
         """Extract skeleton from file content."""
         ext = file_path.suffix.lstrip(".").lower()
+        parser_type = self.parser_types.get(ext)
 
-        # Map extensions to parser types
-        ext_map = {
-            "py": "python",
-            "js": "javascript",
-            "jsx": "jsx",
-            "ts": "typescript",
-            "tsx": "tsx",
-        }
-
-        parser_type = ext_map.get(ext)
-
-        if parser_type and parser_type in self.parsers:
-            return self._extract_with_treesitter(content, parser_type)
+        if parser_type:
+            skeleton = self._extract_with_treesitter(
+                content.encode("utf8", errors="surrogatepass"), parser_type
+            )
+            if skeleton is not None:
+                return skeleton
+            return self._fallback_extract(content, parser_type)
         else:
             return self._fallback_extract(content, ext)
 
-    def _extract_with_treesitter(self, content: str, parser_type: str) -> str:
-        """Extract skeleton using Tree-sitter v0.21+ API."""
+    def extract_skeleton_from_bytes(
+        self, file_path: Path, source_bytes: bytes, parser_type: Optional[str] = None
+    ) -> str:
+        """Extract skeleton from raw UTF-8 source, decoding only if the
+        fallback extractor is needed.
+
+        parser_type skips the suffix lookup when the caller already did it.
+        """
+        if parser_type is None:
+            ext = file_path.suffix.lstrip(".").lower()
+            parser_type = self.parser_types.get(ext)
+        else:
+            ext = parser_type
+
+        if parser_type:
+            skeleton = self._extract_with_treesitter(source_bytes, parser_type)
+            if skeleton is not None:
+                return skeleton
+            ext = parser_type
+        return self._fallback_extract(source_bytes.decode("utf8", errors="ignore"), ext)
+
+    def _extract_with_treesitter(
+        self, source_bytes: bytes, parser_type: str
+    ) -> Optional[str]:
+        """Extract skeleton using Tree-sitter v0.21+ API.
+
+        Returns None when the caller should use the fallback extractor.
+        """
         try:
-            source_bytes = bytes(content, "utf8")
-            parser = self.parsers[parser_type]
+            parser = self._get_parser(parser_type)
             tree = parser.parse(source_bytes)
 
             if parser_type not in self.queries:
-                return self._fallback_extract(content, parser_type)
+                return None
 
-            query = self.queries[parser_type]
-            query_cursor = QueryCursor(query)
+            query_cursor = self._get_cursor(parser_type)
 
             # Use NEW API: captures() returns dict[str, list[Node]]
             captures = query_cursor.captures(tree.root_node)
@@ -386,73 +855,64 @@ class CodeExtractor:
             # Sort by starting position to maintain source order
             all_nodes.sort(key=lambda x: x[1].start_byte)
 
-            result = []
-            lines = content.split("\n")
+            # Every piece is appended to one buffer and decoded once at the end
+            out = bytearray()
             last_import_idx = -1
 
             for idx, (node_type, node) in enumerate(all_nodes):
+                if idx:
+                    out += b"\n"
+
                 if node_type == "import":
-                    start_line = node.start_point[0]
-                    end_line = node.end_point[0]
-                    for i in range(start_line, end_line + 1):
-                        if i < len(lines):
-                            result.append(lines[i])
+                    out += _line_span(source_bytes, node.start_byte, node.end_byte)
                     last_import_idx = idx
+                    continue
 
-                elif node_type == "export":
-                    # Add blank line after imports if this is first non-import
-                    if last_import_idx == idx - 1:
-                        result.append("")
-                    start_line = node.start_point[0]
-                    if start_line < len(lines):
-                        result.append(lines[start_line])
+                # Add blank line after imports if this is first non-import
+                if last_import_idx == idx - 1:
+                    out += b"\n"
 
+                if node_type == "export":
+                    out += _line_span(source_bytes, node.start_byte)
                 elif node_type == "function":
-                    # Add blank line after imports if this is first non-import
-                    if last_import_idx == idx - 1:
-                        result.append("")
                     if parser_type == "python":
-                        result.append(self._extract_function_python(node, lines))
+                        self._extract_function_python(node, source_bytes, out)
                     else:
-                        result.append(self._extract_function_js(node, source_bytes))
-
+                        self._extract_function_js(node, source_bytes, out)
                 elif node_type == "class":
-                    # Add blank line after imports if this is first non-import
-                    if last_import_idx == idx - 1:
-                        result.append("")
                     if parser_type == "python":
-                        result.append(self._extract_class_python(node, lines))
+                        self._extract_class_python(node, source_bytes, out)
                     else:
-                        result.append(self._extract_class_js(node, source_bytes))
+                        self._extract_class_js(node, source_bytes, out)
 
-            return (
-                "\n".join(result)
-                if result
-                else self._fallback_extract(content, parser_type)
-            )
+            return out.decode("utf8") if all_nodes else None
 
         except Exception as e:
             print(f"Warning: Tree-sitter extraction failed: {e}", file=sys.stderr)
-            return self._fallback_extract(content, parser_type)
-
-    def _extract_function_python(self, func_node, lines: List[str]) -> str:
-        """Extract Python function signature and docstring."""
-        result = []
+            return None
 
+    def _extract_function_python(
+        self, func_node, source_bytes: bytes, out: bytearray
+    ) -> None:
+        """Append Python function signature and docstring to out."""
         # Extract signature (may span multiple lines)
         body_node = func_node.child_by_field_name("body")
         if not body_node:
-            return lines[func_node.start_point[0]]  # Fallback
+            out += _line_span(source_bytes, func_node.start_byte)
+            return
 
-        signature_end_line = body_node.start_point[0]
-        for i in range(func_node.start_point[0], signature_end_line):
-            result.append(lines[i])
+        sig_start = source_bytes.rfind(b"\n", 0, func_node.start_byte) + 1
+        body_line_start = source_bytes.rfind(b"\n", 0, body_node.start_byte) + 1
+        if body_line_start > sig_start:
+            # Lines before the body, including their final newline
+            out += source_bytes[sig_start:body_line_start]
 
         # Add the line with colon
-        last_sig_line = lines[signature_end_line]
-        colon_pos = last_sig_line.find(":")
+        last_sig_line = _line_span(source_bytes, body_node.start_byte)
+        colon_pos = last_sig_line.find(b":")
         if colon_pos != -1:
-            result.append(last_sig_line[: colon_pos + 1])
+            out += last_sig_line[: colon_pos + 1]
+            out += b"\n"
 
         # Extract docstring if present
         if body_node.child_count > 0:
@@ -463,39 +923,43 @@ class CodeExtractor:
                 and first_child.children[0].type == "string"
             ):
                 docstring_node = first_child.children[0]
-                doc_start = docstring_node.start_point[0]
-                doc_end = docstring_node.end_point[0]
-                for i in range(doc_start, doc_end + 1):
-                    if i < len(lines):
-                        result.append(lines[i])
+                out += _line_span(
+                    source_bytes, docstring_node.start_byte, docstring_node.end_byte
+                )
+                out += b"\n"
 
-        result.append("    # [Implementation hidden]\n")
-        return "\n".join(result)
+        out += b"    # [Implementation hidden]\n"
 
-    def _extract_function_js(self, func_node, source_bytes: bytes) -> str:
-        """Extract JS/TS function signature."""
+    def _extract_function_js(
+        self, func_node, source_bytes: bytes, out: bytearray
+    ) -> None:
+        """Append JS/TS function signature to out."""
         body_node = func_node.child_by_field_name("body")
         if body_node:
             # Extract from start to body start
-            signature = (
-                source_bytes[func_node.start_byte : body_node.start_byte]
-                .decode("utf8", errors="ignore")
-                .rstrip()
-            )
-            if not signature.endswith("{"):
-                signature += " {"
-            return signature + "\n    // [Implementation hidden]\n}\n"
+            signature = source_bytes[
+                func_node.start_byte : body_node.start_byte
+            ].rstrip()
+            out += signature
+            if not signature.endswith(b"{"):
+                out += b" {"
+            out += b"\n    // [Implementation hidden]\n}\n"
         else:
             # Arrow function or other
-            first_line = func_node.text.decode("utf8", errors="ignore").split("\n")[0]
-            return first_line + " // [Implementation hidden]\n"
-
-    def _extract_class_python(self, class_node, lines: List[str]) -> str:
-        """Extract Python class definition with method signatures."""
-        result = []
-
+            line_end = source_bytes.find(
+                b"\n", func_node.start_byte, func_node.end_byte
+            )
+            if line_end == -1:
+                line_end = func_node.end_byte
+            out += source_bytes[func_node.start_byte : line_end]
+            out += b" // [Implementation hidden]\n"
+
+    def _extract_class_python(
+        self, class_node, source_bytes: bytes, out: bytearray
+    ) -> None:
+        """Append Python class definition with method signatures to out."""
         # Class signature
-        result.append(lines[class_node.start_point[0]])
+        out += _line_span(source_bytes, class_node.start_byte)
 
         # Look for docstring and methods
         body_node = class_node.child_by_field_name("body")
@@ -509,83 +973,75 @@ class CodeExtractor:
                 and first_child.children[0].type == "string"
             ):
                 docstring_node = first_child.children[0]
-                doc_start = docstring_node.start_point[0]
-                doc_end = docstring_node.end_point[0]
-                for i in range(doc_start, doc_end + 1):
-                    if i < len(lines):
-                        result.append(lines[i])
-                result.append("")  # Blank line after docstring
+                out += b"\n"
+                out += _line_span(
+                    source_bytes, docstring_node.start_byte, docstring_node.end_byte
+                )
+                out += b"\n"  # Blank line after docstring
 
             # Extract method signatures
             methods_found = False
             for child in body_node.children:
                 if child.type == "function_definition":
                     methods_found = True
-                    method_sig = self._extract_function_python(child, lines)
-                    # Add proper indentation - methods should already be indented
-                    result.append(method_sig)
+                    out += b"\n"
+                    # Methods are already indented in the source lines
+                    self._extract_function_python(child, source_bytes, out)
 
             if not methods_found:
-                result.append("    # [No methods defined]\n")
-
-        return "\n".join(result)
-
-    def _extract_class_js(self, class_node, source_bytes: bytes) -> str:
-        """Extract JS/TS class definition with method signatures."""
-        result = []
+                out += b"\n    # [No methods defined]\n"
 
+    def _extract_class_js(
+        self, class_node, source_bytes: bytes, out: bytearray
+    ) -> None:
+        """Append JS/TS class definition with method signatures to out."""
         # Class signature
         body_node = class_node.child_by_field_name("body")
         if body_node:
-            signature = (
-                source_bytes[class_node.start_byte : body_node.start_byte]
-                .decode("utf8", errors="ignore")
-                .rstrip()
-            )
-            if not signature.endswith("{"):
-                signature += " {"
-            result.append(signature)
+            signature = source_bytes[
+                class_node.start_byte : body_node.start_byte
+            ].rstrip()
+            out += signature
+            if not signature.endswith(b"{"):
+                out += b" {"
 
             # Extract method signatures from class body
             methods_found = False
             for child in body_node.children:
                 if child.type in ("method_definition", "field_definition"):
                     methods_found = True
-                    # Get the method signature
-                    method_text = child.text.decode("utf8", errors="ignore")
-                    method_lines = method_text.split("\n")
-
-                    # Extract signature (first line, possibly with params on multiple lines)
-                    sig_lines = []
-                    brace_count = 0
-                    for line in method_lines:
-                        sig_lines.append(line)
-                        if "{" in line:
-                            brace_count += line.count("{")
-                            break
-
-                    signature_text = "\n".join(sig_lines)
-                    if "{" in signature_text:
-                        signature_text = signature_text.split("{")[0].rstrip() + " {"
-
-                    result.append("    " + signature_text)
-                    result.append("        // [Implementation hidden]")
-                    result.append("    }")
-                    result.append("")  # Blank line between methods
+                    # Signature runs up to the opening brace (possibly across
+                    # several lines); members without one are kept whole
+                    brace = source_bytes.find(b"{", child.start_byte, child.end_byte)
+                    out += b"\n    "
+                    if brace == -1:
+                        out += source_bytes[child.start_byte : child.end_byte]
+                    else:
+                        out += source_bytes[child.start_byte : brace].rstrip()
+                        out += b" {"
+                    out += b"\n        // [Implementation hidden]\n    }\n"
 
             if not methods_found:
-                result.append("    // [No methods defined]")
+                out += b"\n    // [No methods defined]"
 
-            result.append("}\n")
-            return "\n".join(result)
+            out += b"\n}\n"
         else:
-            return class_node.text.decode("utf8", errors="ignore").split("\n")[0] + "\n"
+            line_end = source_bytes.find(
+                b"\n", class_node.start_byte, class_node.end_byte
+            )
+            if line_end == -1:
+                line_end = class_node.end_byte
+            out += source_bytes[class_node.start_byte : line_end]
+            out += b"\n"
 
     def _fallback_extract(self, content: str, ext: str = "") -> str:
         """AGGRESSIVE fallback extraction - signatures only."""
         lines = content.split("\n")
         result = []
 
+        # Nothing to capture (data files, prose): skip the line-by-line scan
+        scan_lines = lines if _FALLBACK_ANCHOR_RE.search(content) else ()
+
         in_docstring = False
         docstring_char = None
         skip_until_next_def = False
@@ -594,7 +1050,7 @@ class CodeExtractor:
         expect_class_docstring = False
         method_indent = 0  # Track method indentation for docstring detection
 
-        for i, line in enumerate(lines):
+        for i, line in enumerate(scan_lines):
             stripped = line.strip()
             current_indent = len(line) - len(line.lstrip())
 
@@ -624,18 +1080,8 @@ class CodeExtractor:
             # Skip implementation after def/class until next def/class
             if skip_until_next_def and not in_class:
                 # Check if we hit another def/class
-                if any(
-                    stripped.startswith(kw)
-                    for kw in [
-                        "def ",
-                        "class ",
-                        "function ",
-                        "async def",
-                        "async function",
-                        "export function",
-                        "export class",
-                        "export const",
-                    ]
+                if stripped.startswith(_FALLBACK_DEF_KEYWORDS) or stripped.startswith(
+                    "class "
                 ):
                     skip_until_next_def = False
                     # Fall through to process this line
@@ -683,9 +1129,7 @@ class CodeExtractor:
                 in_class = False
 
             # Inside a class, capture method signatures
-            if in_class and any(
-                stripped.startswith(kw) for kw in ["def ", "async def"]
-            ):
+            if in_class and stripped.startswith(("def ", "async def")):
                 result.append(line.split("{")[0].rstrip())
                 method_indent = current_indent  # Track for docstring processing
                 # Check for method docstring on next line
@@ -707,25 +1151,12 @@ class CodeExtractor:
                 continue
 
             # Imports (always include)
-            if stripped.startswith(
-                ("import ", "from ", "const ", "let ", "var ", "export ", "require(")
-            ):
+            if stripped.startswith(_FALLBACK_IMPORT_KEYWORDS):
                 result.append(line)
                 continue
 
             # Function/class definitions (signature only) - top level only
-            if not in_class and any(
-                stripped.startswith(kw)
-                for kw in [
-                    "def ",
-                    "function ",
-                    "async def",
-                    "async function",
-                    "export function",
-                    "export class",
-                    "export const",
-                ]
-            ):
+            if not in_class and stripped.startswith(_FALLBACK_DEF_KEYWORDS):
                 # Just the signature line
                 result.append(line.split("{")[0].rstrip())
 
@@ -759,76 +1190,251 @@ class CodeExtractor:
         return "\n".join(result)
 
 
+def _process_file(candidate, extractor: CodeExtractor, mode: str):
+    """Read one file and extract its skeleton.
+
+    Returns (path, content) for full-content files, (path, skeleton, loc)
+    for skeletons, or None if the file could not be read.
+    """
+    path, should_full = candidate
+    try:
+        source_bytes = _read_source(path)
+    except Exception as e:
+        print(f"Warning: Could not read {path}: {e}", file=sys.stderr)
+        return None
+
+    if mode == "overview":
+        # Overview emits neither contents nor skeletons, only the counts,
+        # so don't decode or parse anything
+        return (path, "") if should_full else (path, "", 0)
+
+    # Parseable sources that are valid UTF-8 with plain LF endings need no
+    # decoding or newline translation: hand the bytes straight to tree-sitter
+    parser_type = extractor.parser_types.get(path.suffix.lstrip(".").lower())
+    if (
+        not should_full
+        and parser_type
+        and b"\r" not in source_bytes
+        and _is_utf8(source_bytes)
+    ):
+        skeleton = extractor.extract_skeleton_from_bytes(
+            path, source_bytes, parser_type
+        )
+        return (path, skeleton, source_bytes.count(b"\n") + 1)
+
+    content = source_bytes.decode("utf-8", errors="ignore")
+    if "\r" in content:
+        # Universal newlines, as read_text() would give
+        content = content.replace("\r\n", "\n").replace("\r", "\n")
+
+    if should_full:
+        return (path, content)
+
+    # Generate skeleton
+    skeleton = extractor.extract_skeleton(path, content)
+    return (path, skeleton, content.count("\n") + 1)
+
+
+# Per-process state for --processes workers, set up by _init_process_worker
+_worker_extractor: Optional[CodeExtractor] = None
+_worker_mode = "skeleton"
+
+
+def _init_process_worker(mode: str) -> None:
+    """Build the worker's own extractor; parsers can't cross process bounds."""
+    global _worker_extractor, _worker_mode
+    _worker_extractor = CodeExtractor()
+    _worker_mode = mode
+
+
+def _process_file_in_worker(candidate):
+    """Process pool entry point for _process_file."""
+    return _process_file(candidate, _worker_extractor, _worker_mode)
+
+
+def _map_chunk(fn, chunk: list) -> list:
+    """Apply fn to each item of a chunk; one pool task per chunk."""
+    return [fn(item) for item in chunk]
+
+
+def _bounded_map(executor, fn, items, window: int, chunksize: int = 1):
+    """Yield fn(item) for each item in order, like executor.map.
+
+    executor.map submits every item up front, so finished results pile up
+    while the caller works through them in order. Here at most ``window``
+    chunks of ``chunksize`` items are queued or waiting at once.
+    """
+    items = iter(items)
+    in_flight = deque()
+
+    def submit() -> None:
+        chunk = list(itertools.islice(items, chunksize))
+        if chunk:
+            in_flight.append(executor.submit(_map_chunk, fn, chunk))
+
+    for _ in range(window):
+        submit()
+    while in_flight:
+        results = in_flight.popleft().result()
+        submit()
+        yield from results
+
+
 class SkeletonGenerator:
     """Main skeleton generator."""
 
+    # Files token-counted per encoder call; bounds how many rendered results
+    # wait in memory at once
+    TOKEN_BATCH_SIZE = 64
+
+    # Rendered section text kept in memory before spilling to a temp file
+    SECTION_SPOOL_SIZE = 8 * 1024 * 1024
+
     def __init__(self, root_path: Path, config: Config):
         self.root = root_path
         self.config = config
-        self.token_counter = TokenCounter()
+        self.token_counter = TokenCounter(
+            TOKEN_CACHE_PATH if config.token_cache else None,
+            exact=config.exact_tokens,
+        )
         self.extractor = CodeExtractor()
         self.stats = {
             "files_processed": 0,
             "full_content": 0,
             "skeleton": 0,
             "excluded": 0,
+            "excluded_dirs": 0,
             "total_tokens": 0,
         }
+        self.pruned_dirs: List[str] = []
+        # Length of the root path plus separator, sliced off entry paths
+        self._root_prefix_len = len(os.path.join(str(self.root), ""))
+        # Directory listings from walk(), reused by the tree
+        self.listings: Dict[str, List[Tuple[bool, str, str]]] = {}
+        self._exclude_cache: Dict[Path, Tuple[bool, str]] = {}
 
     ####
 
     def should_exclude(self, path: Path) -> bool:
-        """Check if path should be excluded."""
-        rel_path = path.relative_to(self.root)
+        """Check if path should be excluded.
+
+        Anything under an excluded directory is excluded too; directory
+        results are cached so each one is matched only once.
+        """
+        parent_excluded, parent_rel = self._dir_state(path.parent)
+        if parent_excluded:
+            return True
+        name = path.name
         # Normalize to forward slashes for cross-platform compatibility
-        rel_path_str = str(rel_path).replace("\\", "/")
+        rel_path_str = f"{parent_rel}/{name}" if parent_rel else name
+        return self._matches_exclude(name, rel_path_str)
+
+    def _dir_state(self, dir_path: Path) -> Tuple[bool, str]:
+        """Return (excluded, relative posix path) for a directory under root."""
+        state = self._exclude_cache.get(dir_path)
+        if state is None:
+            if dir_path == self.root:
+                state = (False, "")
+            elif dir_path == dir_path.parent:
+                # Walked past the filesystem root: not under self.root
+                dir_path.relative_to(self.root)  # raises ValueError
+            else:
+                parent_excluded, parent_rel = self._dir_state(dir_path.parent)
+                name = dir_path.name
+                rel = f"{parent_rel}/{name}" if parent_rel else name
+                excluded = parent_excluded or self._matches_exclude(name, rel)
+                state = (excluded, rel)
+            self._exclude_cache[dir_path] = state
+        return state
+
+    def _matches_exclude(self, name: str, rel_path_str: str) -> bool:
+        """Match one path component and the full relative path against the
+        exclusion rules (parent components are checked by the caller)."""
+        config = self.config
+
+        # Default exclusions and excluded directory names
+        if name in config._exclude_literals:
+            return True
+        if config._exclude_suffixes and name.endswith(config._exclude_suffixes):
+            return True
+        part_re = config._exclude_part_re
+        if part_re is not None and part_re.match(name):
+            return True
 
-        # Check explicit exclusions
-        for pattern in self.config.exclude:
-            pattern_clean = pattern.rstrip("/")
-            # Check if pattern appears in path
-            if pattern_clean in rel_path_str:
-                return True
-            # Also try glob matching
+        # Explicit exclusions
+        path_re = config._exclude_path_re
+        return path_re is not None and path_re.search(rel_path_str) is not None
+
+    def walk(self) -> Iterator[Tuple[Path, int, str]]:
+        """Yield (file, size, relative posix path) under the root, never
+        descending into excluded directories.
+
+        Depth-first in os.walk order: a directory's files, then each of its
+        subdirectories. Entry types come from the cached scandir results and
+        sizes from the entry's own stat. Symlinked directories are not followed.
+        Pruned directories are recorded in ``pruned_dirs`` (relative, with
+        forward slashes), and the listings of directories shallow enough for
+        the tree in ``listings``.
+        """
+        stack = [(self.root, 0)]
+        while stack:
+            dir_path, depth = stack.pop()
+            subdirs = []
+            files = []
+            listing = []
             try:
-                if rel_path.match(pattern):
-                    return True
-            except:
-                pass
-
-        # Check default exclusions
-        for pattern in self.config.DEFAULT_EXCLUDE_PATTERNS:
-            if rel_path.match(pattern) or any(
-                p.match(pattern) for p in rel_path.parents
-            ):
-                return True
-            if "*" not in pattern and pattern in rel_path.parts:
-                return True
+                with os.scandir(dir_path) as it:
+                    for entry in it:
+                        is_dir = entry.is_dir()
+                        listing.append((not is_dir, entry.name, entry.path))
+                        if is_dir:
+                            child = Path(entry.path)
+                            if self.should_exclude(child):
+                                self.pruned_dirs.append(self._dir_state(child)[1])
+                                self.stats["excluded_dirs"] += 1
+                            elif not entry.is_symlink():
+                                subdirs.append((child, depth + 1))
+                        elif entry.is_file():
+                            try:
+                                size = entry.stat().st_size
+                            except OSError:
+                                continue
+                            rel = entry.path[self._root_prefix_len :]
+                            if os.sep != "/":
+                                rel = rel.replace(os.sep, "/")
+                            files.append((Path(entry.path), size, rel))
+            except OSError:
+                continue
 
-        # Check if in excluded directory name
-        for part in rel_path.parts:
-            if part in self.config.EXCLUDE_DIRS:
-                return True
+            if depth < TreeBuilder.MAX_DEPTH:
+                self.listings[str(dir_path)] = listing
+            yield from files
+            stack.extend(reversed(subdirs))
 
-        return False
+    def should_full_content(
+        self, path: Path, rel_path_str: Optional[str] = None
+    ) -> bool:
+        """Check if file should have full content.
 
-    def should_full_content(self, path: Path) -> bool:
-        """Check if file should have full content."""
+        rel_path_str is the posix path relative to the root, if the caller
+        already has it.
+        """
         # In hybrid mode, NOTHING gets full content except config files
         if self.config.mode == "hybrid":
             return path.name in self.config.DEFAULT_FULL_PATTERNS
 
         # Normalize path to use forward slashes for cross-platform compatibility
-        rel_path_str = str(path.relative_to(self.root)).replace("\\", "/")
+        if rel_path_str is None:
+            rel_path_str = self._rel_posix(path)
 
         # Explicit includes
         if rel_path_str in self.config.include_full:
             return True
 
         # Pattern matches
-        for pattern in self.config.include_patterns:
-            if path.match(pattern):
-                return True
+        include_re = self.config._include_re
+        if include_re is not None and include_re.search(path.as_posix().lstrip("/")):
+            return True
 
         # Default full content files (only in non-hybrid mode)
         if path.name in self.config.DEFAULT_FULL_PATTERNS:
@@ -836,119 +1442,241 @@ class SkeletonGenerator:
 
         return False
 
+    def _render_batch(
+        self,
+        pending: list,
+        full_buf: TextIO,
+        skel_buf: TextIO,
+        skel_groups: Optional[Dict[Tuple[str, int], list]] = None,
+    ) -> None:
+        """Token-count pending results in one batch, render them into their
+        section buffers and clear the batch.
+
+        With skel_groups, skeletons only get their token count recorded; they
+        are rendered by _render_skeleton_groups once all paths are known.
+        """
+        counts = self.token_counter.count_batch([result[1] for _, result in pending])
+        for (rel_path, result), tokens in zip(pending, counts):
+            self.stats["total_tokens"] += tokens
+            if len(result) == 2:
+                content = result[1]
+                full_buf.write(f"\n\n<file path='{rel_path}' tokens='{tokens}'>\n")
+                full_buf.write(content)
+                full_buf.write("\n</file>")
+            else:
+                _, skeleton, loc = result
+                if skel_groups is not None:
+                    skel_groups[(skeleton, loc)][0] = tokens
+                    continue
+                skel_buf.write(
+                    f"\n\n<file path='{rel_path}' loc='{loc}' tokens='{tokens}'>\n"
+                )
+                skel_buf.write(skeleton)
+                skel_buf.write("\n</file>")
+        pending.clear()
+
+    def _render_skeleton_groups(
+        self, skel_groups: Dict[Tuple[str, int], list], skel_buf: TextIO
+    ) -> None:
+        """Render each distinct skeleton once, listing every file that has it."""
+        for (skeleton, loc), (tokens, paths) in skel_groups.items():
+            if len(paths) == 1:
+                attr = f"path='{paths[0]}'"
+            else:
+                attr = f"paths='{','.join(paths)}'"
+            skel_buf.write(f"\n\n<file {attr} loc='{loc}' tokens='{tokens}'>\n")
+            skel_buf.write(skeleton)
+            skel_buf.write("\n</file>")
+        skel_groups.clear()
+
+    def _rel_posix(self, path: Path) -> str:
+        """Return path relative to the root, with forward slashes for output."""
+        parent_rel = self._dir_state(path.parent)[1]
+        return f"{parent_rel}/{path.name}" if parent_rel else path.name
+
+    def _section_buffer(self) -> TextIO:
+        """Return a text buffer that spills to disk past SECTION_SPOOL_SIZE."""
+        return tempfile.SpooledTemporaryFile(
+            max_size=self.SECTION_SPOOL_SIZE, mode="w+", encoding="utf-8", newline=""
+        )
+
+    def _process_one(self, candidate):
+        """Read one file and extract its skeleton; runs on a worker thread."""
+        return _process_file(candidate, self.extractor, self.config.mode)
+
     ####
-    def generate(self) -> str:
-        """Generate skeleton output."""
-        output = []
+    def generate(self, out: Optional[TextIO] = None) -> Optional[str]:
+        """Generate skeleton output.
 
-        # Header
-        output.append(f"<codebase project='{self.root.name}'>")
-        output.append("\n<metadata>")
+        Sections are written to ``out`` as soon as they are ready. Without a
+        stream the output is collected and returned as a string.
+        """
+        if out is None:
+            buffer = io.StringIO()
+            self.generate(buffer)
+            return buffer.getvalue()
+
+        write = out.write
+
+        def emit(text: str) -> None:
+            write("\n")
+            write(text)
 
-        # Directory tree
-        output.append("<tree>")
-        tree = TreeBuilder.build(self.root, self.config)
-        output.append(tree)
-        output.append("</tree>\n")
+        # Header
+        write(f"<codebase project='{self.root.name}'>")
+        emit("\n<metadata>")
 
         # Collect files
-        full_files = []
-        skeleton_files = []
+        candidates = []
+        # Relative path of each candidate, in the same order
+        rel_paths = []
         excluded_dirs = defaultdict(int)
+        oversized = []
 
-        for path in self.root.rglob("*"):
-            if not path.is_file():
-                continue
-
+        for path, size, rel_path_str in self.walk():
             # Check exclusion FIRST - excluded directories are completely ignored
-            # regardless of file type or content
-            if self.should_exclude(path):
-                parent = path.parent.relative_to(self.root)
-                # Normalize path for output
-                parent_str = str(parent).replace("\\", "/")
-                excluded_dirs[parent_str] += 1
+            # regardless of file type or content. The walk never enters them,
+            # so only the file's own name and path need matching.
+            if (
+                self._matches_exclude(path.name, rel_path_str)
+                or path.suffix.lower() in self.config.BINARY_EXTENSIONS
+            ):
+                excluded_dirs[rel_path_str.rpartition("/")[0] or "."] += 1
                 self.stats["excluded"] += 1
                 continue  # Stop processing this file completely
 
+            # Oversized files are never read into memory
+            if size > self.config.max_file_size:
+                oversized.append(rel_path_str)
+                self.stats["excluded"] += 1
+                continue
+
             # Now check if remaining files need full content
-            should_full = self.should_full_content(path)
+            candidates.append((path, self.should_full_content(path, rel_path_str)))
+            rel_paths.append(rel_path_str)
+
+        # Directory tree, from the listings the walk already made
+        emit("<tree>")
+        emit(TreeBuilder.build(self.root, self.config, self.listings))
+        self.listings.clear()
+        emit("</tree>\n")
+
+        # Read and parse in parallel; tree-sitter releases the GIL while parsing.
+        # Each result is rendered into its section buffer as it arrives and
+        # then dropped, so contents don't stay alive until the emit stage.
+        emit_full = self.config.mode != "overview"
+        emit_skeleton = self.config.mode in ("skeleton", "hybrid", "custom")
+        # Sections are spooled, since the stats must be written before them
+        full_buf = self._section_buffer()
+        skel_buf = self._section_buffer()
+        # Results waiting for a batched token count before being rendered
+        pending = []
+        # (skeleton, loc) -> [tokens, paths], when deduplicating
+        skel_groups = {} if self.config.dedupe_skeletons else None
+
+        workers = os.cpu_count() or 1
+        if self.config.processes:
+            # Python-level extraction holds the GIL, so separate processes
+            # scale further at the cost of pickling results back
+            executor = ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_process_worker,
+                initargs=(self.config.mode,),
+            )
+            results = _bounded_map(
+                executor,
+                _process_file_in_worker,
+                candidates,
+                window=2 * workers,
+                chunksize=32,
+            )
+        else:
+            executor = ThreadPoolExecutor(max_workers=workers)
+            results = _bounded_map(
+                executor, self._process_one, candidates, window=2 * workers
+            )
 
-            # Try to read the file
-            try:
-                content = path.read_text(encoding="utf-8", errors="ignore")
-            except Exception as e:
-                print(f"Warning: Could not read {path}: {e}", file=sys.stderr)
-                # IMPORTANT: Skip this file entirely if it can't be read
-                # Don't count it as processed, don't add it to output
-                continue
+        with executor:
+            for rel_path, result in zip(rel_paths, results):
+                if result is None:
+                    # IMPORTANT: Skip this file entirely if it can't be read
+                    # Don't count it as processed, don't add it to output
+                    continue
 
-            self.stats["files_processed"] += 1
+                self.stats["files_processed"] += 1
 
-            if should_full:
-                full_files.append((path, content))
-                self.stats["full_content"] += 1
-            else:
-                # Generate skeleton
-                skeleton = self.extractor.extract_skeleton(path, content)
-                skeleton_files.append((path, skeleton, len(content.split("\n"))))
-                self.stats["skeleton"] += 1
+                if len(result) == 2:
+                    self.stats["full_content"] += 1
+                    if emit_full:
+                        pending.append((rel_path, result))
+                else:
+                    self.stats["skeleton"] += 1
+                    if emit_skeleton:
+                        if skel_groups is None:
+                            pending.append((rel_path, result))
+                        else:
+                            _, skeleton, loc = result
+                            group = skel_groups.get((skeleton, loc))
+                            if group is not None:
+                                # Seen before: no need to count or render it again
+                                group[1].append(rel_path)
+                            else:
+                                skel_groups[(skeleton, loc)] = [0, [rel_path]]
+                                pending.append((rel_path, result))
+
+                if len(pending) >= self.TOKEN_BATCH_SIZE:
+                    self._render_batch(pending, full_buf, skel_buf, skel_groups)
+            self._render_batch(pending, full_buf, skel_buf, skel_groups)
+        if skel_groups:
+            self._render_skeleton_groups(skel_groups, skel_buf)
+        self.token_counter.flush()
 
         # Stats
-        output.append("<stats>")
-        output.append(f"Files processed: {self.stats['files_processed']}")
-        output.append(f"Full content: {self.stats['full_content']} files")
-        output.append(f"Skeleton: {self.stats['skeleton']} files")
-        output.append(f"Excluded: {self.stats['excluded']} files")
+        emit("<stats>")
+        emit(f"Files processed: {self.stats['files_processed']}")
+        emit(f"Full content: {self.stats['full_content']} files")
+        emit(f"Skeleton: {self.stats['skeleton']} files")
+        emit(f"Excluded: {self.stats['excluded']} files")
+        emit(f"Excluded directories: {self.stats['excluded_dirs']}")
         if TREE_SITTER_AVAILABLE and self.extractor.parsers:
-            output.append("Tree-sitter: enabled")
+            emit("Tree-sitter: enabled")
         else:
-            output.append("Tree-sitter: disabled (using fallback)")
-        output.append("</stats>")
-        output.append("</metadata>\n")
+            emit("Tree-sitter: disabled (using fallback)")
+        emit("</stats>")
+        emit("</metadata>\n")
 
         # Full content files
-        if full_files and self.config.mode != "overview":
-            output.append("<full-content>")
-            for path, content in full_files:
-                rel_path = path.relative_to(self.root)
-                # Normalize path for output (forward slashes)
-                rel_path_str = str(rel_path).replace("\\", "/")
-                tokens = self.token_counter.count(content)
-                self.stats["total_tokens"] += tokens
-
-                output.append(f"\n<file path='{rel_path_str}' tokens='{tokens}'>")
-                output.append(content)
-                output.append("</file>")
-            output.append("\n</full-content>\n")
+        if self.stats["full_content"] and emit_full:
+            emit("<full-content>")
+            full_buf.seek(0)
+            shutil.copyfileobj(full_buf, out)
+            emit("\n</full-content>\n")
+        full_buf.close()
 
         # Skeleton files
-        if skeleton_files and self.config.mode in ("skeleton", "hybrid", "custom"):
-            output.append("<skeleton>")
-            for path, skeleton, loc in skeleton_files:
-                rel_path = path.relative_to(self.root)
-                # Normalize path for output (forward slashes)
-                rel_path_str = str(rel_path).replace("\\", "/")
-                tokens = self.token_counter.count(skeleton)
-                self.stats["total_tokens"] += tokens
-
-                output.append(
-                    f"\n<file path='{rel_path_str}' loc='{loc}' tokens='{tokens}'>"
-                )
-                output.append(skeleton)
-                output.append("</file>")
-            output.append("\n</skeleton>\n")
+        if self.stats["skeleton"] and emit_skeleton:
+            emit("<skeleton>")
+            skel_buf.seek(0)
+            shutil.copyfileobj(skel_buf, out)
+            emit("\n</skeleton>\n")
+        skel_buf.close()
 
         # Excluded summary (optional, controlled by --show-excluded flag)
-        if excluded_dirs and self.config.show_excluded:
-            output.append("<excluded>")
+        if (
+            excluded_dirs or self.pruned_dirs or oversized
+        ) and self.config.show_excluded:
+            emit("<excluded>")
+            for dir_path in sorted(self.pruned_dirs):
+                emit(f"<directory path='{dir_path}' pruned='true'/>")
             for dir_path, count in sorted(excluded_dirs.items()):
-                output.append(f"<directory path='{dir_path}' files='{count}'/>")
-            output.append("</excluded>\n")
-
-        output.append(f"\n<total-tokens>{self.stats['total_tokens']}</total-tokens>")
-        output.append("</codebase>")
+                emit(f"<directory path='{dir_path}' files='{count}'/>")
+            for file_path in sorted(oversized):
+                emit(f"<file path='{file_path}' skipped='size'/>")
+            emit("</excluded>\n")
 
-        return "\n".join(output)
+        emit(f"\n<total-tokens>{self.stats['total_tokens']}</total-tokens>")
+        emit("</codebase>")
+        return None
 
 
 ###
@@ -1004,6 +1732,12 @@ Install optional dependencies:
     parser.add_argument(
         "--max-tokens", type=int, default=50000, help="Maximum token budget"
     )
+    parser.add_argument(
+        "--max-file-size",
+        type=int,
+        default=10 * 1024 * 1024,
+        help="Skip files larger than this many bytes (default: 10MB)",
+    )
     parser.add_argument(
         "--show-deps", action="store_true", help="Show dependency graph (future)"
     )
@@ -1012,28 +1746,58 @@ Install optional dependencies:
         action="store_true",
         help="Include detailed excluded directories list in output (default: False)",
     )
+    parser.add_argument(
+        "--no-token-cache",
+        action="store_true",
+        help="Don't reuse or save token counts in ~/.cache/codebase_skeleton",
+    )
+    parser.add_argument(
+        "--exact-tokens",
+        action="store_true",
+        help="Tokenize tiny files too instead of bounding them by byte length",
+    )
+    parser.add_argument(
+        "--dedupe-skeletons",
+        action="store_true",
+        help="Emit identical skeletons once, listing all their paths",
+    )
+    parser.add_argument(
+        "--processes",
+        action="store_true",
+        help="Read and extract files in worker processes instead of threads",
+    )
+    parser.add_argument(
+        "--unsorted-tree",
+        action="store_true",
+        help="List the directory tree in filesystem order instead of sorting it",
+    )
 
     parser.add_argument("--output", type=str, help="Output file (default: stdout)")
 
     args = parser.parse_args()
 
+    def split_csv(value: str) -> Set[str]:
+        return set(value.split(",")) if value else set()
+
     # Build config
     config = Config(
         mode=args.mode,
+        include_full=split_csv(args.include_full),
+        include_patterns=split_csv(args.include_patterns),
+        skeleton_only=split_csv(args.skeleton_only),
+        exclude=split_csv(args.exclude),
         max_tokens=args.max_tokens,
+        max_file_size=args.max_file_size,
         show_deps=args.show_deps,
+        show_excluded=args.show_excluded,
+        sorted_tree=not args.unsorted_tree,
+        processes=args.processes,
+        exact_tokens=args.exact_tokens,
+        dedupe_skeletons=args.dedupe_skeletons,
+        token_cache=not args.no_token_cache,
         output=args.output,
     )
 
-    if args.include_full:
-        config.include_full = set(args.include_full.split(","))
-    if args.include_patterns:
-        config.include_patterns = set(args.include_patterns.split(","))
-    if args.skeleton_only:
-        config.skeleton_only = set(args.skeleton_only.split(","))
-    if args.exclude:
-        config.exclude = set(args.exclude.split(","))
-
     # Generate
     root_path = Path(args.path).resolve()
     if not root_path.exists():
@@ -1045,19 +1809,24 @@ Install optional dependencies:
         sys.exit(1)
 
     generator = SkeletonGenerator(root_path, config)
-    output = generator.generate()
 
     # Write output
-    if args.output:
-        Path(args.output).write_text(output, encoding="utf-8")
-        print(f"✅ Skeleton written to {args.output}")
-        print(f"📊 Stats:")
-        print(f"  - Files processed: {generator.stats['files_processed']}")
-        print(f"  - Full content: {generator.stats['full_content']}")
-        print(f"  - Skeleton: {generator.stats['skeleton']}")
-        print(f"  - Total tokens: {generator.stats['total_tokens']}")
-    else:
-        print(output)
+    try:
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                generator.generate(f)
+            print(f"✅ Skeleton written to {args.output}")
+            print(f"📊 Stats:")
+            print(f"  - Files processed: {generator.stats['files_processed']}")
+            print(f"  - Full content: {generator.stats['full_content']}")
+            print(f"  - Skeleton: {generator.stats['skeleton']}")
+            print(f"  - Total tokens: {generator.stats['total_tokens']}")
+        else:
+            generator.generate(sys.stdout)
+            sys.stdout.write("\n")
+    finally:
+        # Persist counts from a partial run too
+        generator.token_counter.close()
 
 
 if __name__ == "__main__":
@@ -1,15 +1,30 @@
 import pytest
 import tempfile
 import os
+import re
 import shutil
 import sys
+from collections import Counter
 from typing import Dict, List
 import logging
+from pathlib import Path
 
 # Configure logging for tests - Windows safe
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 
 
+def write_project_files(root: str, files: Dict[str, str]) -> None:
+    """Write {relative posix path: content} under root.
+
+    Each directory is created once, and each file is written in one call.
+    """
+    dirs = {os.path.dirname(path) for path in files} - {""}
+    for directory in dirs:
+        os.makedirs(os.path.join(root, directory), exist_ok=True)
+    for path, content in files.items():
+        Path(root, path).write_bytes(content.encode("utf-8"))
+
+
 @pytest.fixture(scope="session")
 def test_data_dir():
     """Create a session-level test data directory"""
@@ -95,15 +110,7 @@ pip-log.txt
 """,
         }
 
-        # Create the directory structure with Windows-safe paths
-        for path, content in project_structure.items():
-            full_path = os.path.join(tmpdir, path.replace("/", os.sep))
-            os.makedirs(os.path.dirname(full_path), exist_ok=True)
-            try:
-                with open(full_path, "w", encoding="utf-8") as f:
-                    f.write(content)
-            except Exception as e:
-                logging.warning(f"Could not create {full_path}: {e}")
+        write_project_files(tmpdir, project_structure)
 
         yield tmpdir
 
@@ -124,21 +131,12 @@ const quotes = "It's a test file";
 console.log(html);""",
         }
 
-        for filename, content in problem_files.items():
-            file_path = os.path.join(tmpdir, filename)
-            try:
-                with open(file_path, "w", encoding="utf-8") as f:
-                    f.write(content)
-            except Exception as e:
-                logging.warning(f"Could not create {filename}: {e}")
+        write_project_files(tmpdir, problem_files)
 
         # Create a file with problematic encoding - Windows safe
-        try:
-            latin1_file = os.path.join(tmpdir, "latin1_encoding.txt")
-            with open(latin1_file, "wb") as f:
-                f.write("cafe resume naive".encode("latin-1"))  # ASCII-safe version
-        except Exception as e:
-            logging.warning(f"Could not create latin1 file: {e}")
+        Path(tmpdir, "latin1_encoding.txt").write_bytes(
+            "cafe resume naive".encode("latin-1")  # ASCII-safe version
+        )
 
         # Add realistic test files with proper sizes
         realistic_files = {
@@ -148,13 +146,7 @@ console.log(html);""",
             ".env.example": "DATABASE_URL=sqlite:///test.db\nDEBUG=true\nSECRET_KEY=your_secret_here",
         }
 
-        for filename, content in realistic_files.items():
-            file_path = os.path.join(tmpdir, filename)
-            try:
-                with open(file_path, "w", encoding="utf-8") as f:
-                    f.write(content)
-            except Exception as e:
-                logging.warning(f"Could not create {filename}: {e}")
+        write_project_files(tmpdir, realistic_files)
 
         yield tmpdir
 
@@ -197,10 +189,10 @@ def standard_processing_params():
 def large_test_project():
     """Create a larger test project for performance/memory testing"""
     with tempfile.TemporaryDirectory() as tmpdir:
+        files = {}
         # Create a more realistic larger project structure
         for i in range(20):  # Reduced from 50 for faster testing
-            module_dir = os.path.join(tmpdir, f"module_{i:02d}")
-            os.makedirs(module_dir, exist_ok=True)
+            module_dir = f"module_{i:02d}"
 
             # Create varied content to avoid tiktoken performance issues
             module_content = f"""
@@ -243,18 +235,13 @@ def utility_function_{i}(data):
     return f"Processed by module {i}: {{data}}"
 """
 
-            try:
-                with open(os.path.join(module_dir, "__init__.py"), "w") as f:
-                    f.write(f"# Module {i} init\n")
-                with open(os.path.join(module_dir, "processor.py"), "w") as f:
-                    f.write(module_content)
-                with open(os.path.join(module_dir, "config.json"), "w") as f:
-                    f.write(
-                        f'{{"module_id": {i}, "enabled": true, "priority": {i % 5}}}'
-                    )
-            except Exception as e:
-                logging.warning(f"Could not create module {i}: {e}")
+            files[f"{module_dir}/__init__.py"] = f"# Module {i} init\n"
+            files[f"{module_dir}/processor.py"] = module_content
+            files[f"{module_dir}/config.json"] = (
+                f'{{"module_id": {i}, "enabled": true, "priority": {i % 5}}}'
+            )
 
+        write_project_files(tmpdir, files)
         yield tmpdir
 
 
@@ -279,17 +266,26 @@ def create_file_with_content(
     return filepath
 
 
+# Every marker validate_xml_structure looks at. None contains "<" or "`"
+# past its first character, so one scan counts each exactly as str.count
+# would; "<files>" and "<file " are listed before the bare "<file".
+_STRUCTURE_TOKEN_RE = re.compile(
+    r"</?codebase>|<project|</?files>|<file |<file|</file>|</?dep>|```"
+)
+
+
 def validate_xml_structure(content: str) -> Dict[str, any]:
     """Validate the XML-like structure of processor output"""
+    counts = Counter(_STRUCTURE_TOKEN_RE.findall(content))
     validation_result = {
-        "has_codebase_tags": "<codebase>" in content and "</codebase>" in content,
-        "has_project_info": "<project" in content,
-        "has_files_section": "<files>" in content and "</files>" in content,
-        "file_count": content.count("<file "),
-        "balanced_file_tags": content.count("<file") == content.count("</file>"),
-        "balanced_dep_tags": content.count("<dep>") == content.count("</dep>"),
-        "has_content_blocks": content.count("```") % 2
-        == 0,  # Even number of code blocks
+        "has_codebase_tags": bool(counts["<codebase>"] and counts["</codebase>"]),
+        "has_project_info": bool(counts["<project"]),
+        "has_files_section": bool(counts["<files>"] and counts["</files>"]),
+        "file_count": counts["<file "],
+        "balanced_file_tags": counts["<file "] + counts["<file"] + counts["<files>"]
+        == counts["</file>"],
+        "balanced_dep_tags": counts["<dep>"] == counts["</dep>"],
+        "has_content_blocks": counts["```"] % 2 == 0,  # Even number of code blocks
         "errors": [],
     }
 
@@ -330,6 +326,5 @@ def pytest_configure(config):
 
 def pytest_runtest_setup(item):
     """Skip certain tests on Windows"""
-    if "skip_on_windows" in [marker.name for marker in item.iter_markers()]:
-        if sys.platform.startswith("win"):
-            pytest.skip("Skipped on Windows")
+    if sys.platform.startswith("win") and item.get_closest_marker("skip_on_windows"):
+        pytest.skip("Skipped on Windows")
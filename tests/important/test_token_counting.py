@@ -1,7 +1,12 @@
 import pytest
 import time
 import tiktoken
-from xml_directory_processor import count_tokens
+import xml_directory_processor
+from xml_directory_processor import (
+    count_tokens,
+    count_tokens_batch,
+    estimate_tokens_upper_bound,
+)
 
 
 @pytest.mark.important
@@ -64,3 +69,22 @@ class TestTokenCounting:
             expected = len(encoding.encode(case))
             tokens = count_tokens(case)
             assert tokens == expected, f"Edge case failed: {repr(case)}"
+
+    def test_upper_bound_estimate_never_undercounts(self):
+        """Test the cheap estimate is an upper bound on the exact count"""
+        cases = ["", "a", "hello world", "café", "🎉🎊", "Hello, 世界! 🌍", "\n\n\n"]
+        for text in cases:
+            assert estimate_tokens_upper_bound(text) >= count_tokens(text), repr(text)
+
+    def test_chunked_count_matches_whole_text(self):
+        """Test large texts counted in pieces give the exact whole-text count"""
+        encoding = tiktoken.get_encoding("cl100k_base")
+        lines = ["def f(x):", "    return x  # café", "", "};", "\t's 12345", "  "]
+        large_text = "\n".join(lines * 20000) + "\n"
+        expected = len(encoding.encode_ordinary(large_text))
+
+        # Each call starts with an empty cache so its own split path runs
+        xml_directory_processor._TOKEN_COUNT_CACHE.clear()
+        assert count_tokens(large_text) == expected
+        xml_directory_processor._TOKEN_COUNT_CACHE.clear()
+        assert count_tokens_batch(["x", large_text]) == [1, expected]
@@ -5,6 +5,23 @@ import xml.etree.ElementTree as ET
 from xml_directory_processor import process_directory_structured
 
 
+def _strip_fences(text):
+    """Remove ```-fenced blocks in one linear pass over the text."""
+    parts = []
+    pos = 0
+    while True:
+        start = text.find("```", pos)
+        if start == -1:
+            break
+        end = text.find("```", start + 3)
+        if end == -1:
+            break
+        parts.append(text[pos:start])
+        pos = end + 3
+    parts.append(text[pos:])
+    return "".join(parts)
+
+
 @pytest.mark.important
 class TestXMLOutputIntegrity:
     """Test XML output format and special character handling - Important Priority"""
@@ -101,10 +118,7 @@ class TestXMLOutputIntegrity:
                 content = f.read()
 
             # Remove content blocks for XML parsing (they contain code, not XML)
-            xml_content = content
-            import re
-
-            xml_content = re.sub(r"```.*?```", "", xml_content, flags=re.DOTALL)
+            xml_content = _strip_fences(content)
 
             try:
                 root = ET.fromstring(xml_content)
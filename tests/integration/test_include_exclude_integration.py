@@ -10,16 +10,29 @@ Tests end-to-end behavior with real file system operations.
 import pytest
 import tempfile
 import os
+import re
+import io
+import contextlib
+import shutil
 from pathlib import Path
-import subprocess
-import sys
+from types import SimpleNamespace
 
+import xml_directory_processor
 
-@pytest.fixture
-def test_project_structure(tmp_path):
+pytestmark = pytest.mark.integration
+
+# Extracts file paths from <file path='...'> tags
+_FILE_PATH_RE = re.compile(r"<file path='([^']+)'")
+
+
+@pytest.fixture(scope="session")
+def test_project_structure(tmp_path_factory):
     """
     Create a realistic project structure for testing.
 
+    Built once per session and shared, so tests must not modify it; tests
+    that add files use mutable_test_project_structure instead.
+
     Structure:
     project/
     ├── src/
@@ -39,7 +52,7 @@ def test_project_structure(tmp_path):
     │   └── config
     └── README.md
     """
-    project = tmp_path / "project"
+    project = tmp_path_factory.mktemp("project_structure") / "project"
     project.mkdir()
 
     # Source directory
@@ -79,18 +92,49 @@ def test_project_structure(tmp_path):
     return project
 
 
+@pytest.fixture
+def mutable_test_project_structure(test_project_structure, tmp_path):
+    """A private copy of test_project_structure that the test may modify."""
+    return Path(shutil.copytree(test_project_structure, tmp_path / "project"))
+
+
+@pytest.fixture(scope="session")
+def large_project_structure(tmp_path_factory):
+    """
+    Create a larger project of 5 directories with 50 files each.
+
+    Built once per session and shared, so tests must not modify it.
+    """
+    project = tmp_path_factory.mktemp("large_project")
+
+    # Create multiple directories with files
+    for dir_name in ["src", "tests", "docs", "scripts", "data"]:
+        dir_path = project / dir_name
+        dir_path.mkdir()
+        for i in range(50):  # 50 files per directory
+            (dir_path / f"file_{i}.py").write_text(f"# File {i}")
+
+    return project
+
+
 def run_processor(project_path, output_path, *args):
-    """Helper to run the xml_directory_processor with given arguments."""
-    cmd = [
-        sys.executable,
-        "xml_directory_processor.py",
-        str(project_path),
-        "--output",
-        str(output_path),
-        *args,
-    ]
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    return result
+    """
+    Helper to run the xml_directory_processor with given arguments.
+
+    Calls main() in-process rather than starting a new interpreter, and
+    returns an object with the returncode, stdout and stderr of the run.
+    """
+    argv = [str(project_path), "--output", str(output_path), *args]
+    stdout, stderr = io.StringIO(), io.StringIO()
+    returncode = 0
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        try:
+            xml_directory_processor.main(argv)
+        except SystemExit as e:
+            returncode = 0 if e.code is None else e.code
+    return SimpleNamespace(
+        returncode=returncode, stdout=stdout.getvalue(), stderr=stderr.getvalue()
+    )
 
 
 def parse_output_files(output_path):
@@ -102,11 +146,7 @@ def parse_output_files(output_path):
     with open(output_path, "r", encoding="utf-8") as f:
         content = f.read()
 
-    # Extract file paths from <file path='...'> tags
-    import re
-
-    pattern = r"<file path='([^']+)'"
-    matches = re.findall(pattern, content)
+    matches = _FILE_PATH_RE.findall(content)
 
     # Normalize paths to forward slashes for consistent assertions
     normalized = [p.replace("\\", "/") for p in matches]
@@ -307,14 +347,19 @@ class TestIncludeExcludeCombination:
         # Should NOT include .pyc files
         assert not any(".pyc" in f for f in files)
 
-    def test_exclude_overrides_include(self, test_project_structure, tmp_path):
+    def test_exclude_overrides_include(self, mutable_test_project_structure, tmp_path):
         """Verify that exclude takes precedence over include."""
         # Create a file that matches both include and exclude
-        (test_project_structure / "src" / "temp.py").write_text("# temp")
+        (mutable_test_project_structure / "src" / "temp.py").write_text("# temp")
 
         output = tmp_path / "output.txt"
         result = run_processor(
-            test_project_structure, output, "--include", "src", "--exclude", "temp.py"
+            mutable_test_project_structure,
+            output,
+            "--include",
+            "src",
+            "--exclude",
+            "temp.py",
         )
 
         assert result.returncode == 0
@@ -418,15 +463,17 @@ class TestRealWorldUseCases:
         # Should NOT include code files
         assert not any(".py" in f for f in files)
 
-    def test_exclude_generated_files(self, test_project_structure, tmp_path):
+    def test_exclude_generated_files(self, mutable_test_project_structure, tmp_path):
         """Exclude build artifacts and generated files."""
         # Create some generated files
-        (test_project_structure / "generated.py").write_text("# auto-generated")
-        (test_project_structure / "src" / "generated.py").write_text("# auto-generated")
+        (mutable_test_project_structure / "generated.py").write_text("# auto-generated")
+        (mutable_test_project_structure / "src" / "generated.py").write_text(
+            "# auto-generated"
+        )
 
         output = tmp_path / "output.txt"
         result = run_processor(
-            test_project_structure, output, "--exclude", "build", "generated.py"
+            mutable_test_project_structure, output, "--exclude", "build", "generated.py"
         )
 
         assert result.returncode == 0
@@ -498,17 +545,19 @@ class TestEdgeCasesIntegration:
         # Exclude should win
         assert not any("src/" in f for f in files)
 
-    def test_nested_directory_filtering(self, test_project_structure, tmp_path):
+    def test_nested_directory_filtering(self, mutable_test_project_structure, tmp_path):
         """Test filtering in nested directory structures."""
         # Create deeper nesting
-        nested = test_project_structure / "src" / "models" / "user"
+        nested = mutable_test_project_structure / "src" / "models" / "user"
         nested.mkdir(parents=True)
         (nested / "model.py").write_text("class User: pass")
 
         output = tmp_path / "output.txt"
 
         # Include the parent directory 'src' to get all nested content
-        result = run_processor(test_project_structure, output, "--include", "src")
+        result = run_processor(
+            mutable_test_project_structure, output, "--include", "src"
+        )
 
         assert result.returncode == 0
         files = parse_output_files(output)
@@ -526,25 +575,16 @@ class TestEdgeCasesIntegration:
 class TestPerformanceIntegration:
     """Test performance with realistic project sizes."""
 
-    def test_large_directory_with_include(self, tmp_path):
+    def test_large_directory_with_include(self, large_project_structure, tmp_path):
         """Test performance when including specific directories in large projects."""
         import time
 
-        # Create a larger project structure
-        project = tmp_path / "large_project"
-        project.mkdir()
-
-        # Create multiple directories with files
-        for dir_name in ["src", "tests", "docs", "scripts", "data"]:
-            dir_path = project / dir_name
-            dir_path.mkdir()
-            for i in range(50):  # 50 files per directory
-                (dir_path / f"file_{i}.py").write_text(f"# File {i}")
-
         output = tmp_path / "output.txt"
 
         start = time.time()
-        result = run_processor(project, output, "--include", "src", "--exclude", "data")
+        result = run_processor(
+            large_project_structure, output, "--include", "src", "--exclude", "data"
+        )
         duration = time.time() - start
 
         assert result.returncode == 0
@@ -573,19 +613,21 @@ class TestErrorHandling:
         assert result.returncode in [0, 1]  # Either success or graceful failure
 
     @pytest.mark.skip_on_windows
-    def test_permission_denied_directory(self, test_project_structure, tmp_path):
+    def test_permission_denied_directory(
+        self, mutable_test_project_structure, tmp_path
+    ):
         """Test handling when directory has permission issues."""
         # This test is platform-specific and may not work on all systems
         if os.name != "posix":
             pytest.skip("Permission test only on POSIX systems")
 
-        restricted = test_project_structure / "restricted"
+        restricted = mutable_test_project_structure / "restricted"
         restricted.mkdir()
         (restricted / "secret.py").write_text("secret")
         os.chmod(restricted, 0o000)
 
         output = tmp_path / "output.txt"
-        result = run_processor(test_project_structure, output)
+        result = run_processor(mutable_test_project_structure, output)
 
         # Should handle gracefully
         assert result.returncode == 0
@@ -599,15 +641,10 @@ class TestCommandLineInterface:
 
     def test_help_shows_new_options(self):
         """Verify --include and --exclude appear in help."""
-        result = subprocess.run(
-            [sys.executable, "xml_directory_processor.py", "--help"],
-            capture_output=True,
-            text=True,
-        )
+        help_text = xml_directory_processor.build_argparser().format_help()
 
-        assert result.returncode == 0
-        assert "--include" in result.stdout
-        assert "--exclude" in result.stdout
+        assert "--include" in help_text
+        assert "--exclude" in help_text
 
     def test_multiple_include_patterns_syntax(self, test_project_structure, tmp_path):
         """Test various ways to specify multiple patterns."""
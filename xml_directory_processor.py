@@ -22,16 +22,20 @@ FIXES:
 import os
 import sys
 import argparse
+import atexit
 import re
 import tiktoken
 import json
 import logging
 import hashlib
+import mmap
 from tqdm import tqdm
 from pathlib import Path
-from typing import List, Dict, Tuple, Set, Optional
-import nbconvert
+from typing import Iterator, List, Dict, Tuple, Set, Optional
 import fnmatch
+import functools
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 
 # Windows console encoding fix
 if os.name == "nt":
@@ -60,10 +64,255 @@ def setup_logging(log_file: str, enable_logging: bool = True):
         logging.basicConfig(level=logging.ERROR, handlers=[logging.NullHandler()])
 
 
+# cl100k_base encoding, loaded on first use by _get_encoding()
+_ENCODING = None
+
+
+def _get_encoding():
+    """Return the shared cl100k_base encoding, loading it once."""
+    global _ENCODING
+    if _ENCODING is None:
+        _ENCODING = tiktoken.get_encoding("cl100k_base")
+    return _ENCODING
+
+
+# Token counts for recently seen texts, keyed by content hash. Shorter texts
+# are re-encoded; hashing them costs about as much.
+TOKEN_CACHE_SIZE = 4096
+MIN_CACHED_LENGTH = 256
+_TOKEN_COUNT_CACHE: Dict[bytes, int] = {}
+
+
+def _token_cache_key(text: str) -> bytes:
+    """Content hash used as the token-count cache key."""
+    return hashlib.blake2b(
+        text.encode("utf-8", "surrogatepass"), digest_size=16
+    ).digest()
+
+
+def _store_token_count(key: bytes, tokens: int) -> None:
+    """Cache a count, dropping the oldest entry once the cache is full."""
+    if len(_TOKEN_COUNT_CACHE) >= TOKEN_CACHE_SIZE:
+        del _TOKEN_COUNT_CACHE[next(iter(_TOKEN_COUNT_CACHE))]
+    _TOKEN_COUNT_CACHE[key] = tokens
+
+
+# Texts longer than this are encoded in pieces of about TOKEN_CHUNK_CHARS,
+# so the token list for a large file is never held in full
+TOKEN_CHUNK_THRESHOLD = 256 * 1024
+TOKEN_CHUNK_CHARS = 64 * 1024
+
+# A newline followed by a non-space character always ends a cl100k_base
+# pre-token, so counts for text split there add up to the exact count
+_TOKEN_BOUNDARY_RE = re.compile(r"\n(?=\S)")
+
+
+def _token_chunks(text: str) -> Iterator[str]:
+    """Split text at token boundaries into pieces that can be counted separately."""
+    if len(text) <= TOKEN_CHUNK_THRESHOLD:
+        yield text
+        return
+    start = 0
+    while len(text) - start > TOKEN_CHUNK_CHARS:
+        boundary = _TOKEN_BOUNDARY_RE.search(text, start + TOKEN_CHUNK_CHARS)
+        if boundary is None:
+            break
+        yield text[start : boundary.end()]
+        start = boundary.end()
+    yield text[start:]
+
+
 def count_tokens(text: str) -> int:
-    """Count tokens in text using tiktoken."""
-    encoding = tiktoken.get_encoding("cl100k_base")
-    return len(encoding.encode(text))
+    """Count tokens in text using tiktoken.
+
+    Special-token markers such as <|endoftext|> are counted as plain text.
+    Counts for identical content are reused.
+    """
+    if len(text) < MIN_CACHED_LENGTH:
+        return len(_get_encoding().encode_ordinary(text))
+
+    key = _token_cache_key(text)
+    tokens = _TOKEN_COUNT_CACHE.get(key)
+    if tokens is None:
+        encoding = _get_encoding()
+        tokens = sum(
+            len(encoding.encode_ordinary(chunk)) for chunk in _token_chunks(text)
+        )
+        _store_token_count(key, tokens)
+    return tokens
+
+
+def estimate_tokens_upper_bound(text: str) -> int:
+    """Upper bound on count_tokens(text) without encoding it.
+
+    Every token covers at least one UTF-8 byte, so the byte length is never
+    below the real count.
+    """
+    if text.isascii():
+        return len(text)
+    return len(text.encode("utf-8", errors="surrogatepass"))
+
+
+# Files per batch of reads and token counts, and a cap on the bytes held
+TOKEN_BATCH_FILES = 64
+TOKEN_BATCH_BYTES = 16 * 1024 * 1024
+
+
+def count_tokens_batch(texts: List[str]) -> List[int]:
+    """Count tokens for several texts in one call, encoded on parallel threads.
+
+    Texts whose count is cached, or repeated within the batch, are only
+    encoded once.
+    """
+    counts = [0] * len(texts)
+    misses = {}  # cache key (or index, for short texts) -> indices
+    for i, text in enumerate(texts):
+        if len(text) < MIN_CACHED_LENGTH:
+            misses[i] = [i]
+            continue
+        key = _token_cache_key(text)
+        tokens = _TOKEN_COUNT_CACHE.get(key)
+        if tokens is not None:
+            counts[i] = tokens
+        else:
+            misses.setdefault(key, []).append(i)
+
+    if misses:
+        # Large texts are split into pieces that are encoded, a group at a
+        # time, alongside the rest, then summed per text
+        pieces = (
+            (indices, chunk)
+            for indices in misses.values()
+            for chunk in _token_chunks(texts[indices[0]])
+        )
+        encoding = _get_encoding()
+        while True:
+            group = list(itertools.islice(pieces, TOKEN_BATCH_FILES))
+            if not group:
+                break
+            encoded = encoding.encode_ordinary_batch(
+                [chunk for _, chunk in group], num_threads=os.cpu_count() or 1
+            )
+            for (indices, _), tokens in zip(group, encoded):
+                for i in indices:
+                    counts[i] += len(tokens)
+        for key, indices in misses.items():
+            if isinstance(key, bytes):
+                _store_token_count(key, counts[indices[0]])
+    return counts
+
+
+def _scan_dir(path: str):
+    """List path for _scandir_walk.
+
+    Returns ({dir name: entry}, [file entries]), or None if the directory
+    can't be read.
+    """
+    try:
+        scandir_it = os.scandir(path)
+    except OSError:
+        return None
+
+    dir_entries = {}
+    files = []
+    with scandir_it:
+        try:
+            for entry in scandir_it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    dir_entries[entry.name] = entry
+                else:
+                    files.append(entry)
+        except OSError:
+            return None  # Listing failed part way: skip the directory
+    return dir_entries, files
+
+
+def _scandir_walk(top: str, parallel: bool = False):
+    """Top-down os.walk(top) that keeps the scandir entries of files.
+
+    Yields (root, dirs, files): dirs is a list of names the caller may prune
+    in place, as with os.walk; files are os.DirEntry objects, whose stat()
+    is fetched at most once. Unreadable directories are skipped and
+    symlinked directories are not descended into, as os.walk does by
+    default.
+
+    With parallel, each directory's subdirectories are listed on worker
+    threads (scandir releases the GIL) while the caller handles it; scans
+    of pruned ones are cancelled. The order of results is the same.
+    """
+    executor = None
+    if parallel:
+        executor = ThreadPoolExecutor(max_workers=(os.cpu_count() or 1) * 2)
+
+    try:
+        stack = [(top, None)]
+        while stack:
+            root, future = stack.pop()
+            listing = future.result() if future is not None else _scan_dir(root)
+            if listing is None:
+                continue
+            dir_entries, files = listing
+
+            prefetched = {}
+            if executor is not None:
+                for name, entry in dir_entries.items():
+                    if not entry.is_symlink():
+                        prefetched[name] = executor.submit(
+                            _scan_dir, os.path.join(root, name)
+                        )
+
+            dirs = list(dir_entries)
+            yield root, dirs, files
+
+            kept = set(dirs)
+            for name, pending_scan in prefetched.items():
+                if name not in kept:
+                    pending_scan.cancel()
+
+            for name in reversed(dirs):
+                new_path = os.path.join(root, name)
+                entry = dir_entries.get(name)
+                is_link = entry.is_symlink() if entry else os.path.islink(new_path)
+                if not is_link:
+                    stack.append((new_path, prefetched.get(name)))
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Key indicator files and the project type each one implies
+PROJECT_MARKER_FILES = {
+    "package.json": {"type": "nodejs", "language": "javascript"},
+    "requirements.txt": {"type": "python", "language": "python"},
+    "pyproject.toml": {"type": "python", "language": "python"},
+    "setup.py": {"type": "python", "language": "python"},
+    "Cargo.toml": {"type": "rust", "language": "rust"},
+    "go.mod": {"type": "go", "language": "go"},
+    "pom.xml": {"type": "java", "language": "java"},
+    "build.gradle": {"type": "java", "language": "java"},
+    "composer.json": {"type": "php", "language": "php"},
+    "Gemfile": {"type": "ruby", "language": "ruby"},
+}
+
+CONFIG_FILE_NAMES = frozenset(
+    ["config.json", "settings.py", ".env.example", "docker-compose.yml", "Dockerfile"]
+)
+ENTRY_POINT_FILE_NAMES = frozenset(
+    ["main.py", "app.py", "index.js", "server.js", "main.go", "main.rs"]
+)
+BUILD_FILE_NAMES = frozenset(
+    ["Makefile", "build.sh", "webpack.config.js", "vite.config.js"]
+)
+TEST_DIR_NAMES = frozenset(["test", "tests", "__tests__", "spec"])
+
+# Every file name detect_project_type records; other files are skipped
+_DETECTION_FILES = frozenset(PROJECT_MARKER_FILES).union(
+    CONFIG_FILE_NAMES, ENTRY_POINT_FILE_NAMES, BUILD_FILE_NAMES
+)
 
 
 def detect_project_type(root_path: str) -> Dict[str, any]:
@@ -79,24 +328,12 @@ def detect_project_type(root_path: str) -> Dict[str, any]:
         "build_files": [],
     }
 
-    # Check for key indicator files
-    key_files = {
-        "package.json": {"type": "nodejs", "language": "javascript"},
-        "requirements.txt": {"type": "python", "language": "python"},
-        "pyproject.toml": {"type": "python", "language": "python"},
-        "setup.py": {"type": "python", "language": "python"},
-        "Cargo.toml": {"type": "rust", "language": "rust"},
-        "go.mod": {"type": "go", "language": "go"},
-        "pom.xml": {"type": "java", "language": "java"},
-        "build.gradle": {"type": "java", "language": "java"},
-        "composer.json": {"type": "php", "language": "php"},
-        "Gemfile": {"type": "ruby", "language": "ruby"},
-    }
-
     try:
-        for root, dirs, files in os.walk(root_path):
+        for root, dirs, file_entries in _scandir_walk(root_path):
             if root.count(os.sep) - root_path.count(os.sep) > 2:  # Limit depth
+                dirs[:] = []  # Everything below is deeper still
                 continue
+            files = [entry.name for entry in file_entries]
 
             # Handle permission errors for directories
             try:
@@ -110,6 +347,8 @@ def detect_project_type(root_path: str) -> Dict[str, any]:
                 continue
 
             for file in accessible_files:
+                if file not in _DETECTION_FILES:
+                    continue
                 try:
                     full_file_path = os.path.join(root, file)
 
@@ -117,39 +356,21 @@ def detect_project_type(root_path: str) -> Dict[str, any]:
                     if not os.access(full_file_path, os.R_OK):
                         continue
 
-                    if file in key_files:
-                        info = key_files[file]
+                    if file in PROJECT_MARKER_FILES:
+                        info = PROJECT_MARKER_FILES[file]
                         project_info.update(info)
                         project_info["dependency_files"].append(full_file_path)
 
                     # Config files
-                    if file in [
-                        "config.json",
-                        "settings.py",
-                        ".env.example",
-                        "docker-compose.yml",
-                        "Dockerfile",
-                    ]:
+                    if file in CONFIG_FILE_NAMES:
                         project_info["config_files"].append(full_file_path)
 
                     # Entry points
-                    if file in [
-                        "main.py",
-                        "app.py",
-                        "index.js",
-                        "server.js",
-                        "main.go",
-                        "main.rs",
-                    ]:
+                    if file in ENTRY_POINT_FILE_NAMES:
                         project_info["entry_points"].append(full_file_path)
 
                     # Build files
-                    if file in [
-                        "Makefile",
-                        "build.sh",
-                        "webpack.config.js",
-                        "vite.config.js",
-                    ]:
+                    if file in BUILD_FILE_NAMES:
                         project_info["build_files"].append(full_file_path)
 
                 except Exception as e:
@@ -159,7 +380,7 @@ def detect_project_type(root_path: str) -> Dict[str, any]:
             # Test directories with error handling
             for dir_name in accessible_dirs:
                 try:
-                    if dir_name in ["test", "tests", "__tests__", "spec"]:
+                    if dir_name in TEST_DIR_NAMES:
                         full_dir_path = os.path.join(root, dir_name)
                         if os.path.isdir(full_dir_path) and os.access(
                             full_dir_path, os.R_OK
@@ -178,10 +399,16 @@ def detect_project_type(root_path: str) -> Dict[str, any]:
     return project_info
 
 
-def get_file_metadata(file_path: str) -> Dict[str, any]:
-    """Extract metadata useful for recreation."""
+def get_file_metadata(
+    file_path: str, stat: Optional[os.stat_result] = None
+) -> Dict[str, any]:
+    """Extract metadata useful for recreation.
+
+    stat is the file's stat result, if the caller already has it.
+    """
     try:
-        stat = os.stat(file_path)
+        if stat is None:
+            stat = os.stat(file_path)
         ext = os.path.splitext(file_path)[1]
 
         metadata = {
@@ -239,6 +466,15 @@ def extract_imports_dependencies(content: str, file_path: str) -> List[str]:
 
 def should_include_file(file_path: str, file_size: int, params: Dict) -> bool:
     """Determine if a file should be included based on extension and size filters."""
+    # Common case: no extension filter and too small for either size limit,
+    # so the extension doesn't need to be looked at
+    if (
+        not params["exclude_extensions"]
+        and file_size <= params["json_size_threshold"]
+        and file_size <= params["max_file_size"]
+    ):
+        return True
+
     ext = os.path.splitext(file_path)[1].lower()
 
     if ext in params["exclude_extensions"]:
@@ -256,36 +492,73 @@ def should_include_file(file_path: str, file_size: int, params: Dict) -> bool:
     return True
 
 
-def should_ignore_path(path: str, ignore_patterns: List[str]) -> bool:
-    """
-    Checks if a given path should be ignored based on a list of patterns.
-    Supports simple name matching (e.g., '.git'), wildcard matching ('*.pyc'),
-    and multi-segment path matching (e.g., 'integrity/firefox').
+def _compile_globs(patterns: List[str]) -> Optional[re.Pattern]:
+    """One regex matching anything fnmatch would match against any of patterns."""
+    if not patterns:
+        return None
+    return re.compile(
+        "|".join(fnmatch.translate(os.path.normcase(p)) for p in patterns)
+    )
+
+
+@functools.lru_cache(maxsize=32)
+def compile_path_patterns(
+    patterns: Tuple[str, ...],
+) -> Tuple[Optional[re.Pattern], Optional[re.Pattern], Tuple[str, ...]]:
     """
-    path_obj = Path(path)
-    path_parts = path_obj.parts
+    Split path patterns into simple name patterns and multi-segment patterns.
 
-    for pattern in ignore_patterns:
+    Returns (name regex, multi-segment regex, normalized multi-segment
+    patterns). Each list of globs is compiled into a single alternation, so
+    a path component is tested once rather than once per pattern.
+    """
+    name_patterns = []
+    path_patterns = []
+    for pattern in patterns:
         # Strip trailing slashes
         clean_pattern = pattern.rstrip("/\\")
-
-        # Case 1: Simple pattern (no path separators) - check individual components
         if os.sep not in clean_pattern and "/" not in clean_pattern:
-            for part in path_parts:
-                if fnmatch.fnmatch(part, clean_pattern):
-                    return True
-
-        # Case 2: Multi-segment pattern - check against full path
+            name_patterns.append(clean_pattern)
         else:
             # Normalize pattern separators to match current OS
-            norm_pattern = clean_pattern.replace("/", os.sep).replace("\\", os.sep)
+            path_patterns.append(
+                clean_pattern.replace("/", os.sep).replace("\\", os.sep)
+            )
+    return (
+        _compile_globs(name_patterns),
+        _compile_globs(path_patterns),
+        tuple(path_patterns),
+    )
 
-            # Check all possible contiguous sub-paths
-            for i in range(len(path_parts)):
-                for j in range(i, len(path_parts)):
-                    sub_path = os.sep.join(path_parts[i : j + 1])
-                    if fnmatch.fnmatch(sub_path, norm_pattern):
-                        return True
+
+def _any_sub_path_matches(path_parts: Tuple[str, ...], regex: re.Pattern) -> bool:
+    """Check all possible contiguous sub-paths against regex."""
+    for i in range(len(path_parts)):
+        for j in range(i, len(path_parts)):
+            sub_path = os.sep.join(path_parts[i : j + 1])
+            if regex.match(os.path.normcase(sub_path)):
+                return True
+    return False
+
+
+def should_ignore_path(path: str, ignore_patterns: List[str]) -> bool:
+    """
+    Checks if a given path should be ignored based on a list of patterns.
+    Supports simple name matching (e.g., '.git'), wildcard matching ('*.pyc'),
+    and multi-segment path matching (e.g., 'integrity/firefox').
+    """
+    name_regex, path_regex, _ = compile_path_patterns(tuple(ignore_patterns))
+    path_parts = Path(path).parts
+
+    # Case 1: Simple pattern (no path separators) - check individual components
+    if name_regex is not None:
+        for part in path_parts:
+            if name_regex.match(os.path.normcase(part)):
+                return True
+
+    # Case 2: Multi-segment pattern - check against full path
+    if path_regex is not None:
+        return _any_sub_path_matches(path_parts, path_regex)
 
     return False
 
@@ -300,46 +573,63 @@ def should_process_path(path: str, include_patterns: List[str]) -> bool:
     if not include_patterns:
         return True  # No include filter means process everything
 
+    name_regex, path_regex, path_patterns = compile_path_patterns(
+        tuple(include_patterns)
+    )
     path_obj = Path(path)
     path_parts = path_obj.parts
     path_str = str(path_obj)
 
-    for pattern in include_patterns:
-        clean_pattern = pattern.rstrip("/\\")
+    # Case 1: Simple pattern (no separators) - match against parts
+    if name_regex is not None:
+        for part in path_parts:
+            if name_regex.match(os.path.normcase(part)):
+                return True
 
-        # Case 1: Simple pattern (no separators) - match against parts
-        if os.sep not in clean_pattern and "/" not in clean_pattern:
-            for part in path_parts:
-                if fnmatch.fnmatch(part, clean_pattern):
-                    return True
+    # Case 2: Multi-segment or full path pattern
+    if path_regex is not None:
+        # Check if path matches pattern
+        if path_regex.match(os.path.normcase(path_str)):
+            return True
 
-        # Case 2: Multi-segment or full path pattern
-        else:
-            norm_pattern = clean_pattern.replace("/", os.sep).replace("\\", os.sep)
+        # Check if path starts with pattern (for directory inclusion)
+        if path_str.startswith(path_patterns):
+            return True
 
-            # Check if path matches pattern
-            if fnmatch.fnmatch(path_str, norm_pattern):
-                return True
+        # Check if any sub-path matches
+        return _any_sub_path_matches(path_parts, path_regex)
 
-            # Check if path starts with pattern (for directory inclusion)
-            if path_str.startswith(norm_pattern):
-                return True
+    return False
 
-            # Check if any sub-path matches
-            for i in range(len(path_parts)):
-                for j in range(i, len(path_parts)):
-                    sub_path = os.sep.join(path_parts[i : j + 1])
-                    if fnmatch.fnmatch(sub_path, norm_pattern):
-                        return True
 
-    return False
+# nbconvert takes longer to import than everything else together, so it is
+# only imported by _get_markdown_exporter() once a notebook turns up
+nbconvert = None
+
+# (exporter class, exporter instance), created on first use by
+# _get_markdown_exporter()
+_MARKDOWN_EXPORTER = None
+
+
+def _get_markdown_exporter() -> "nbconvert.MarkdownExporter":
+    """Return the shared notebook exporter, setting up its templates once.
+
+    A new one is made if nbconvert.MarkdownExporter has been replaced, so
+    patching it takes effect.
+    """
+    global nbconvert, _MARKDOWN_EXPORTER
+    if nbconvert is None:
+        import nbconvert
+    exporter_class = nbconvert.MarkdownExporter
+    if _MARKDOWN_EXPORTER is None or _MARKDOWN_EXPORTER[0] is not exporter_class:
+        _MARKDOWN_EXPORTER = (exporter_class, exporter_class())
+    return _MARKDOWN_EXPORTER[1]
 
 
 def convert_notebook_to_markdown(notebook_path: str) -> str:
     """Convert Jupyter notebook to markdown format."""
     logging.info(f"Converting notebook to markdown: {notebook_path}")
-    markdown_exporter = nbconvert.MarkdownExporter()
-    body, _ = markdown_exporter.from_filename(notebook_path)
+    body, _ = _get_markdown_exporter().from_filename(notebook_path)
 
     md_path = notebook_path.rsplit(".", 1)[0] + ".md"
     with open(md_path, "w", encoding="utf-8") as f:
@@ -349,6 +639,75 @@ def convert_notebook_to_markdown(notebook_path: str) -> str:
     return md_path
 
 
+# Files at least this large are decoded straight from a memory map
+MMAP_THRESHOLD = 1024 * 1024
+
+ENCODINGS_TO_TRY = ["utf-8", "latin-1", "cp1252", "ascii"]
+
+
+def read_text_file(
+    file_path: str, file_size: int
+) -> Tuple[Optional[str], Optional[str]]:
+    """Read a file as text, trying ENCODINGS_TO_TRY in order.
+
+    Returns (content, encoding used), or (None, None) if the file can't be
+    read or decoded. Large files are decoded from a memory map, so only the
+    decoded string is held in memory, not a copy of the raw bytes as well.
+    Newlines are translated as in text mode.
+    """
+    if file_size >= MMAP_THRESHOLD:
+        try:
+            with open(file_path, "rb") as f, mmap.mmap(
+                f.fileno(), 0, access=mmap.ACCESS_READ
+            ) as mm:
+                for encoding in ENCODINGS_TO_TRY:
+                    try:
+                        content = str(mm, encoding)
+                    except (UnicodeDecodeError, UnicodeError):
+                        continue
+                    if "\r" in content:
+                        content = content.replace("\r\n", "\n").replace("\r", "\n")
+                    return content, encoding
+            return None, None
+        except ValueError:
+            pass  # Emptied since it was sized; can't map it, read it normally
+        except OSError as e:
+            logging.error(f"Cannot read file {file_path}: {str(e)}")
+            return None, None
+
+    for encoding in ENCODINGS_TO_TRY:
+        try:
+            with open(file_path, "r", encoding=encoding) as f:
+                return f.read(), encoding
+        except (UnicodeDecodeError, UnicodeError):
+            continue
+        except (PermissionError, OSError) as e:
+            logging.error(f"Cannot read file {file_path}: {str(e)}")
+            break
+    return None, None
+
+
+# Thread pool for file reads, created on first use by _get_read_executor()
+_READ_EXECUTOR = None
+
+
+def _get_read_executor() -> ThreadPoolExecutor:
+    """Return the shared pool that overlaps blocking file reads."""
+    global _READ_EXECUTOR
+    if _READ_EXECUTOR is None:
+        _READ_EXECUTOR = ThreadPoolExecutor(thread_name_prefix="xml-read")
+    return _READ_EXECUTOR
+
+
+@atexit.register
+def _shutdown_read_executor() -> None:
+    """Stop the shared read pool; the next _get_read_executor() makes a new one."""
+    global _READ_EXECUTOR
+    if _READ_EXECUTOR is not None:
+        _READ_EXECUTOR.shutdown()
+        _READ_EXECUTOR = None
+
+
 def safe_write_to_output(output_file, content: str):
     """Safely write content to output file with Windows encoding handling."""
     try:
@@ -360,6 +719,82 @@ def safe_write_to_output(output_file, content: str):
         logging.warning(f"Content written with ASCII fallback due to encoding issues")
 
 
+# Entries with less content than this are joined and written in one call
+ENTRY_BUFFER_LIMIT = 256 * 1024
+
+# Quote characters escaped in single-quoted XML attribute values, in one pass
+_XML_ATTR_ESCAPES = str.maketrans({"'": "&apos;", '"': "&quot;"})
+
+
+def write_file_entry(
+    output_file,
+    file_path: str,
+    rel_path: str,
+    file_size: int,
+    metadata: Dict,
+    content: str,
+    content_tokens: int,
+    params: Dict,
+) -> None:
+    """Write one file's entry, or its token_limit placeholder if it is too long."""
+    if content_tokens <= params["token_limit"]:
+        # Extract imports for dependency mapping
+        try:
+            imports = extract_imports_dependencies(content, file_path)
+        except Exception as e:
+            logging.warning(f"Error extracting imports from {file_path}: {str(e)}")
+            imports = []
+
+        # Write structured file entry
+        try:
+            file_header = f"<file path='{rel_path}' size='{file_size}' ext='{metadata['extension']}'"
+            if metadata.get("executable"):
+                file_header += " executable='true'"
+            if imports:
+                # Sanitize imports for XML attributes
+                clean_imports = []
+                for imp in imports[:5]:
+                    try:
+                        clean_imp = imp.translate(_XML_ATTR_ESCAPES)
+                        clean_imp.encode("ascii", "ignore")
+                        clean_imports.append(clean_imp)
+                    except (UnicodeEncodeError, UnicodeError):
+                        continue
+                if clean_imports:
+                    file_header += f" imports='{','.join(clean_imports)}'"
+            file_header += ">\n```\n"
+            file_footer = "```\n</file>\n\n"
+            if not content.endswith("\n"):
+                file_footer = "\n" + file_footer
+
+            if len(content) < ENTRY_BUFFER_LIMIT:
+                # Small entries go out in a single write
+                safe_write_to_output(output_file, file_header + content + file_footer)
+            else:
+                # Large content is written as-is rather than copied into one string
+                safe_write_to_output(output_file, file_header)
+                safe_write_to_output(output_file, content)
+                safe_write_to_output(output_file, file_footer)
+        except Exception as e:
+            logging.error(f"Error writing content for {file_path}: {str(e)}")
+            try:
+                safe_write_to_output(
+                    output_file,
+                    f"<file path='{rel_path}' size='{file_size}' error='write_failed'></file>\n",
+                )
+            except:
+                pass
+    else:
+        try:
+            safe_write_to_output(
+                output_file,
+                f"<file path='{rel_path}' size='{file_size}' excluded='token_limit'></file>\n",
+            )
+        except:
+            pass
+        logging.info(f"Content excluded due to token limit: {file_path}")
+
+
 def process_directory_structured(
     root_path: str,
     params: Dict,
@@ -374,6 +809,15 @@ def process_directory_structured(
     NEW: Applies include/exclude filtering based on command-line arguments.
     """
 
+    # Filters are tested for every file: look extensions up in a set, and
+    # keep patterns as tuples so their compiled forms are cached
+    params = dict(params)
+    if "exclude_extensions" in params:
+        params["exclude_extensions"] = frozenset(params["exclude_extensions"])
+    for key in ("ignore_patterns", "include"):
+        if key in params:
+            params[key] = tuple(params[key])
+
     # Write project header
     safe_write_to_output(output_file, "<codebase>\n")
     safe_write_to_output(
@@ -420,7 +864,128 @@ def process_directory_structured(
     ignored_directories = []
     ignored_file_count = 0
 
-    for root, dirs, files in os.walk(root_path):
+    # Output entries in order: plain text, or a file waiting to be read and
+    # token-counted. Files are handled in batches, so anything written after
+    # a queued file is queued too.
+    pending = []
+    pending_files = 0
+    pending_bytes = 0
+    read_executor = _get_read_executor() if params.get("parallel", True) else None
+
+    def emit(text: str) -> None:
+        if pending:
+            pending.append(text)
+        else:
+            safe_write_to_output(output_file, text)
+
+    def queue_file(entry: Tuple[str, str, int, Dict]) -> None:
+        nonlocal pending_files, pending_bytes
+        pending.append(entry)
+        pending_files += 1
+        pending_bytes += entry[2]
+        if pending_files >= TOKEN_BATCH_FILES or pending_bytes >= TOKEN_BATCH_BYTES:
+            flush_pending()
+
+    def read_queued(entry: Tuple[str, str, int, Dict]):
+        """(content, encoding) for a queued file, or False if reading raised."""
+        try:
+            return read_text_file(entry[0], entry[2])
+        except Exception as e:
+            logging.error(f"Error processing file {entry[0]}: {str(e)}")
+            return False
+
+    def flush_pending() -> None:
+        nonlocal pending_files, pending_bytes
+        queued = [entry for entry in pending if not isinstance(entry, str)]
+        # Reads overlap on worker threads; map() keeps them in queue order
+        if read_executor is not None:
+            reads = list(read_executor.map(read_queued, queued))
+        else:
+            reads = [read_queued(entry) for entry in queued]
+        contents = [result[0] if result else None for result in reads]
+
+        # Only files that might exceed the limit need an exact count
+        counts = [
+            0 if content is None else estimate_tokens_upper_bound(content)
+            for content in contents
+        ]
+        uncertain = [i for i, n in enumerate(counts) if n > params["token_limit"]]
+        try:
+            exact = count_tokens_batch([contents[i] for i in uncertain])
+        except Exception as e:
+            logging.error(f"Error counting tokens in batch: {str(e)}")
+            exact = []
+            for i in uncertain:
+                file_path, content = queued[i][0], contents[i]
+                try:
+                    exact.append(count_tokens(content))
+                except Exception as e:
+                    logging.error(f"Error counting tokens for {file_path}: {str(e)}")
+                    exact.append(len(content) // 4)  # Rough estimate fallback
+        for i, n in zip(uncertain, exact):
+            counts[i] = n
+
+        results = zip(reads, counts)
+        for entry in pending:
+            if isinstance(entry, str):
+                try:
+                    safe_write_to_output(output_file, entry)
+                except:
+                    pass
+                continue
+            file_path, rel_path, file_size, metadata = entry
+            result, content_tokens = next(results)
+            if result is False:
+                try:
+                    safe_write_to_output(
+                        output_file,
+                        f"<file path='{rel_path}' error='processing_failed'></file>\n",
+                    )
+                except:
+                    pass
+                continue
+
+            content, encoding_used = result
+            if content is None:
+                try:
+                    safe_write_to_output(
+                        output_file,
+                        f"<file path='{rel_path}' size='{file_size}' error='encoding_failed'></file>\n",
+                    )
+                except:
+                    pass
+                continue
+
+            if encoding_used != "utf-8":
+                logging.warning(f"File {file_path} read with {encoding_used} encoding")
+
+            try:
+                write_file_entry(
+                    output_file,
+                    file_path,
+                    rel_path,
+                    file_size,
+                    metadata,
+                    content,
+                    content_tokens,
+                    params,
+                )
+            except Exception as e:
+                logging.error(f"Error processing file {file_path}: {str(e)}")
+                try:
+                    safe_write_to_output(
+                        output_file,
+                        f"<file path='{rel_path}' error='processing_failed'></file>\n",
+                    )
+                except:
+                    pass
+        pending.clear()
+        pending_files = pending_bytes = 0
+
+    # Subdirectories are listed ahead on worker threads; reading and output
+    # stay on this thread, in walk order
+    parallel_scan = params.get("parallel", True)
+    for root, dirs, files in _scandir_walk(root_path, parallel_scan):
         # Early directory filtering with include/exclude logic
         original_dirs = dirs[:]
         dirs[:] = []
@@ -445,7 +1010,7 @@ def process_directory_structured(
                     # Count files in ignored directory for summary
                     try:
                         dir_file_count = 0
-                        for _, _, ignored_files in os.walk(dir_path):
+                        for _, _, ignored_files in _scandir_walk(dir_path):
                             dir_file_count += len(ignored_files)
                             # Limit counting to avoid performance issues
                             if dir_file_count > 10000:
@@ -469,8 +1034,7 @@ def process_directory_structured(
                     logging.error(f"Permission denied accessing directory: {dir_path}")
                     try:
                         rel_path = os.path.relpath(dir_path, root_path)
-                        safe_write_to_output(
-                            output_file,
+                        emit(
                             f"<directory path='{rel_path}' error='permission_denied'></directory>\n",
                         )
                     except:
@@ -479,8 +1043,7 @@ def process_directory_structured(
                     logging.error(f"Error accessing directory {dir_path}: {str(e)}")
                     try:
                         rel_path = os.path.relpath(dir_path, root_path)
-                        safe_write_to_output(
-                            output_file,
+                        emit(
                             f"<directory path='{rel_path}' error='access_failed'></directory>\n",
                         )
                     except:
@@ -491,7 +1054,8 @@ def process_directory_structured(
                 continue
 
         # Process files in current directory
-        for file in sorted(files):
+        for file_entry in sorted(files, key=lambda entry: entry.name):
+            file = file_entry.name
             file_path = os.path.join(root, file)
 
             try:
@@ -512,14 +1076,14 @@ def process_directory_structured(
                 logging.debug(f"Ignored file: {file_path}")
                 continue
 
-            # Get file size with error handling
+            # Get file size with error handling; the stat is reused for metadata
             try:
-                file_size = os.path.getsize(file_path)
+                file_stat = file_entry.stat()
+                file_size = file_stat.st_size
             except OSError as e:
                 logging.error(f"Cannot access file: {file_path} - {str(e)}")
                 try:
-                    safe_write_to_output(
-                        output_file,
+                    emit(
                         f"<file path='{rel_path}' error='access_failed'></file>\n",
                     )
                 except:
@@ -528,8 +1092,7 @@ def process_directory_structured(
             except Exception as e:
                 logging.error(f"Error getting size for {file_path}: {str(e)}")
                 try:
-                    safe_write_to_output(
-                        output_file,
+                    emit(
                         f"<file path='{rel_path}' error='size_check_failed'></file>\n",
                     )
                 except:
@@ -544,14 +1107,14 @@ def process_directory_structured(
                     file_path = md_path
                     rel_path = os.path.relpath(md_path, root_path)
                     file_size = os.path.getsize(md_path)
+                    file_stat = None
                     file = os.path.basename(md_path)
                 except Exception as e:
                     logging.error(
                         f"Error converting notebook {original_file_path}: {str(e)}"
                     )
                     try:
-                        safe_write_to_output(
-                            output_file,
+                        emit(
                             f"<file path='{rel_path}' error='notebook_conversion_failed'></file>\n",
                         )
                     except:
@@ -560,118 +1123,17 @@ def process_directory_structured(
 
             if should_include_file(file_path, file_size, params):
                 try:
-                    metadata = get_file_metadata(file_path)
+                    metadata = get_file_metadata(file_path, file_stat)
                     metadata["relative_path"] = rel_path
 
-                    # Read file content with multiple encoding attempts
-                    content = None
-                    encodings_to_try = ["utf-8", "latin-1", "cp1252", "ascii"]
-                    encoding_used = None
-
-                    for encoding in encodings_to_try:
-                        try:
-                            with open(file_path, "r", encoding=encoding) as f:
-                                content = f.read()
-                                encoding_used = encoding
-                            break
-                        except (UnicodeDecodeError, UnicodeError):
-                            continue
-                        except (PermissionError, OSError) as e:
-                            logging.error(f"Cannot read file {file_path}: {str(e)}")
-                            break
-
-                    if content is None:
-                        try:
-                            safe_write_to_output(
-                                output_file,
-                                f"<file path='{rel_path}' size='{file_size}' error='encoding_failed'></file>\n",
-                            )
-                        except:
-                            pass
-                        continue
-
-                    if encoding_used != "utf-8":
-                        logging.warning(
-                            f"File {file_path} read with {encoding_used} encoding"
-                        )
-
-                    # Count tokens with error handling
-                    try:
-                        content_tokens = count_tokens(content)
-                    except Exception as e:
-                        logging.error(
-                            f"Error counting tokens for {file_path}: {str(e)}"
-                        )
-                        content_tokens = len(content) // 4  # Rough estimate fallback
-
-                    if content_tokens <= params["token_limit"]:
-                        # Extract imports for dependency mapping
-                        try:
-                            imports = extract_imports_dependencies(content, file_path)
-                        except Exception as e:
-                            logging.warning(
-                                f"Error extracting imports from {file_path}: {str(e)}"
-                            )
-                            imports = []
-
-                        # Write structured file entry
-                        try:
-                            file_header = f"<file path='{rel_path}' size='{file_size}' ext='{metadata['extension']}'"
-                            if metadata.get("executable"):
-                                file_header += " executable='true'"
-                            if imports:
-                                # Sanitize imports for XML attributes
-                                clean_imports = []
-                                for imp in imports[:5]:
-                                    try:
-                                        clean_imp = imp.replace("'", "&apos;").replace(
-                                            '"', "&quot;"
-                                        )
-                                        clean_imp.encode("ascii", "ignore")
-                                        clean_imports.append(clean_imp)
-                                    except (UnicodeEncodeError, UnicodeError):
-                                        continue
-                                if clean_imports:
-                                    file_header += (
-                                        f" imports='{','.join(clean_imports)}'"
-                                    )
-                            file_header += ">\n"
-
-                            safe_write_to_output(output_file, file_header)
-                            safe_write_to_output(output_file, "```\n")
-                            safe_write_to_output(output_file, content)
-                            if not content.endswith("\n"):
-                                safe_write_to_output(output_file, "\n")
-                            safe_write_to_output(output_file, "```\n")
-                            safe_write_to_output(output_file, "</file>\n\n")
-                        except Exception as e:
-                            logging.error(
-                                f"Error writing content for {file_path}: {str(e)}"
-                            )
-                            try:
-                                safe_write_to_output(
-                                    output_file,
-                                    f"<file path='{rel_path}' size='{file_size}' error='write_failed'></file>\n",
-                                )
-                            except:
-                                pass
-                    else:
-                        try:
-                            safe_write_to_output(
-                                output_file,
-                                f"<file path='{rel_path}' size='{file_size}' excluded='token_limit'></file>\n",
-                            )
-                        except:
-                            pass
-                        logging.info(
-                            f"Content excluded due to token limit: {file_path}"
-                        )
+                    # Reading and token counting are batched; the entry is
+                    # written on flush
+                    queue_file((file_path, rel_path, file_size, metadata))
 
                 except Exception as e:
                     logging.error(f"Error processing file {file_path}: {str(e)}")
                     try:
-                        safe_write_to_output(
-                            output_file,
+                        emit(
                             f"<file path='{rel_path}' error='processing_failed'></file>\n",
                         )
                     except:
@@ -679,6 +1141,8 @@ def process_directory_structured(
             else:
                 excluded_files.append((file_path, file_size))
 
+    flush_pending()
+
     # Add summary for ignored directories
     if ignored_directories:
         safe_write_to_output(output_file, "\n<!-- Ignored directories summary -->\n")
@@ -711,7 +1175,8 @@ def parse_patterns(pattern_list: List[str]) -> List[str]:
     return [p.strip() for p in processed if p.strip()]
 
 
-def main():
+def build_argparser() -> argparse.ArgumentParser:
+    """Build the command-line argument parser."""
     parser = argparse.ArgumentParser(
         description="Process directory for optimal LLM parsing and codebase recreation"
     )
@@ -851,11 +1316,22 @@ def main():
         default=1000000,
         help="Token threshold for suggesting file splitting (default: 1,000,000)",
     )
+    parser.add_argument(
+        "--no-parallel",
+        dest="parallel",
+        action="store_false",
+        help="Run directory listing and file reads on the main thread only, "
+        "without worker threads",
+    )
+    return parser
+
 
-    args = parser.parse_args()
+def main(argv: Optional[List[str]] = None):
+    args = build_argparser().parse_args(argv)
 
     # Setup logging
     setup_logging(args.log_file, args.enable_logging)
+    list_dir_ignored.clear()  # main() may run more than once in a process
 
     # Parse and combine patterns
     user_include_patterns = parse_patterns(args.include)
@@ -904,6 +1380,9 @@ def main():
         logging.error(f"Error during processing: {str(e)}")
         print(f"Error during processing: {str(e)}")
         sys.exit(1)
+    finally:
+        # main() may run more than once in a process
+        _shutdown_read_executor()
 
     # Token counting and analysis
     try: